@@ -0,0 +1,124 @@
+from collections import deque
+
+
+# Measured cost of each module type: how long it takes to generate and to
+# render, as exponentially weighted moving averages in seconds
+class CostModel:
+    def __init__(self, defaults, alpha=0.2):
+        # render cost assumed for module types that haven't rendered yet, by "static" or "animated"
+        self.defaults = defaults
+        self.alpha = alpha
+        self.generate = {}
+        self.render = {}
+
+    def record(self, table, module_class, seconds):
+        average = table.get(module_class)
+        table[module_class] = seconds if average is None else average + self.alpha * (seconds - average)
+
+    def record_generate(self, module_class, seconds):
+        self.record(self.generate, module_class, seconds)
+
+    def record_render(self, module_class, seconds):
+        self.record(self.render, module_class, seconds)
+
+    def render_cost(self, module_class):
+        cost = self.render.get(module_class)
+        if cost is None:
+            cost = self.defaults["animated" if module_class.animated_render else "static"]
+        return cost
+
+    def bomb_cost(self, module_classes):
+        return sum(map(self.render_cost, module_classes))
+
+    # generating a bomb renders nothing, but holds up the event loop about as long
+    def generate_cost(self, module_classes):
+        return sum(self.generate.get(module_class, 0) for module_class in module_classes)
+
+    def stats(self):
+        module_classes = sorted({*self.generate, *self.render}, key=self.render_cost, reverse=True)
+        if not module_classes:
+            return "No modules measured yet."
+        return '\n'.join(f"{module_class.__name__}: generate {self.generate.get(module_class, 0) * 1000:.1f}ms, "
+                         f"render {self.render_cost(module_class) * 1000:.1f}ms" for module_class in module_classes)
+
+
+# Decides whether a requested bomb may start. Quotas limit the bombs and
+# unsolved modules of each guild (or DM channel), and the live load, the
+# render time it would take to show every unsolved module once, is kept
+# under `capacity` by making new bombs wait for modules to be solved. A new
+# bomb counts with the time generating it takes on top of its render cost.
+class Admission:
+    def __init__(self, bombs_per_guild, modules_per_guild, capacity, queue_size, render_defaults):
+        self.bombs_per_guild = bombs_per_guild
+        self.modules_per_guild = modules_per_guild
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.costs = CostModel(render_defaults)
+        # (channel, module classes) of bombs waiting for capacity
+        self.queue = deque()
+        self.queued = 0
+        self.rejected = 0
+
+    @staticmethod
+    def quota_key(channel):
+        return channel.guild if channel.guild is not None else channel.id
+
+    def is_queued(self, channel):
+        return any(queued_channel is channel for queued_channel, _ in self.queue)
+
+    def load(self, bombs):
+        return sum(self.costs.render_cost(type(module)) for bomb in bombs for module in bomb.modules if not module.solved)
+
+    # Returns why the bomb can't be started in this channel, or None
+    def check_quota(self, channel, module_classes, bombs):
+        key = Admission.quota_key(channel)
+        guild_bombs = [bomb for bomb in bombs if Admission.quota_key(bomb.channel) == key]
+        guild_queued = [queued for queued_channel, queued in self.queue if Admission.quota_key(queued_channel) == key]
+        bomb_count = len(guild_bombs) + len(guild_queued)
+        module_count = (sum(1 for bomb in guild_bombs for module in bomb.modules if not module.solved)
+                        + sum(map(len, guild_queued)) + len(module_classes))
+        if bomb_count >= self.bombs_per_guild:
+            self.rejected += 1
+            return f"There {'is' if bomb_count == 1 else 'are'} already {bomb_count} {'bomb' if bomb_count == 1 else 'bombs'} running or waiting here, which is the limit. Solve or detonate one first."
+        if module_count > self.modules_per_guild:
+            self.rejected += 1
+            return f"This bomb would bring the unsolved modules here to {module_count}, but the limit is {self.modules_per_guild}. Try a smaller bomb or solve some modules first."
+        return None
+
+    def fits(self, module_classes, bombs):
+        bombs = list(bombs)
+        # a bomb always gets to start on an idle bot, however big it is
+        return not bombs or self.load(bombs) + self.start_cost(module_classes) <= self.capacity
+
+    def start_cost(self, module_classes):
+        return self.costs.bomb_cost(module_classes) + self.costs.generate_cost(module_classes)
+
+    # Returns the position in the queue, or None if the queue is full
+    def enqueue(self, channel, module_classes):
+        if len(self.queue) >= self.queue_size:
+            self.rejected += 1
+            return None
+        self.queue.append((channel, module_classes))
+        self.queued += 1
+        return len(self.queue)
+
+    # Bombs from the front of the queue that fit now, in order
+    def ready(self, bombs):
+        bombs = list(bombs)
+        load = self.load(bombs)
+        started = []
+        while self.queue:
+            channel, module_classes = self.queue[0]
+            if (bombs or started) and load + self.start_cost(module_classes) > self.capacity:
+                break
+            self.queue.popleft()
+            started.append((channel, module_classes))
+            load += self.costs.bomb_cost(module_classes)
+        return started
+
+    def stats(self, bombs):
+        return (f"Live load: {self.load(bombs):.2f}s of {self.capacity:g}s render capacity\n"
+                f"Quotas: {self.bombs_per_guild} bombs, {self.modules_per_guild} unsolved modules per server\n"
+                f"Waiting: {len(self.queue)}/{self.queue_size}, queued so far: {self.queued}, rejected: {self.rejected}\n"
+                f"{self.costs.stats()}")
+
@@ -14,12 +14,23 @@ class Mode(enum.Enum):
         return self.name
 
 
+# How a module shows its new image: post a new message and delete the previous
+# one, or edit the previous message in place
+class ViewMode(enum.Enum):
+    Replace = enum.auto()
+    Edit = enum.auto()
+
+    def __str__(self):
+        return self.name
+
+
 class BombSetting:
-    def __init__(self, mode: Mode):
+    def __init__(self, mode: Mode, view: ViewMode):
         self.mode = mode
+        self.view = view
 
 
-DEFAULT_SETTINGS = BombSetting(Mode.Normal)
+DEFAULT_SETTINGS = BombSetting(Mode.Normal, ViewMode.Replace)
 
 
 def get_handler(name: str, t: type):
@@ -0,0 +1,170 @@
+import io
+import re
+import math
+import hashlib
+import functools
+import cairocffi
+
+# SVG sizes are in pt, cairo's in px at 96 dpi like cairosvg
+PT = 96 / 72
+
+PATH_TOKEN = re.compile(r"[MmLlHhVvCcSsQqZz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+PATH_ARGUMENTS = {"M": 2, "L": 2, "H": 1, "V": 1, "C": 6, "S": 4, "Q": 4, "Z": 0}
+
+
+# SVG path data parsed once into absolute move_to, line_to, curve_to and
+# close_path calls. Arcs and T are not supported, none of the modules use them.
+class Path:
+    def __init__(self, d):
+        self.commands = Path.parse(d)
+        # stands in for the path data in render cache keys
+        self.digest = hashlib.blake2b(d.encode(), digest_size=12).hexdigest()
+
+    def __repr__(self):
+        return f"Path({self.digest})"
+
+    @staticmethod
+    def parse(d):
+        tokens = PATH_TOKEN.findall(d)
+        commands = []
+        x = y = start_x = start_y = 0.0
+        # second control point of the last curve, for S
+        control = None
+        command = None
+        index = 0
+        while index < len(tokens):
+            if tokens[index].isalpha():
+                command = tokens[index]
+                index += 1
+            elif command is None or command in "Zz":
+                raise ValueError(f"Path data has numbers without a command: {d[:20]}")
+            upper = command.upper()
+            if upper not in PATH_ARGUMENTS:
+                raise ValueError(f"Unsupported path command {command}")
+            count = PATH_ARGUMENTS[upper]
+            arguments = [float(token) for token in tokens[index:index + count]]
+            if len(arguments) < count:
+                raise ValueError(f"Path command {command} is missing arguments")
+            index += count
+            if command.islower() and upper not in "HVZ":
+                arguments = [value + (x if i % 2 == 0 else y) for i, value in enumerate(arguments)]
+
+            if upper == "M":
+                x, y = start_x, start_y = arguments
+                commands.append(("move_to", x, y))
+                # further pairs after a move are lines
+                command = "l" if command == "m" else "L"
+            elif upper in "LHV":
+                if upper == "H":
+                    x = arguments[0] + (x if command == "h" else 0)
+                elif upper == "V":
+                    y = arguments[0] + (y if command == "v" else 0)
+                else:
+                    x, y = arguments
+                commands.append(("line_to", x, y))
+            elif upper in "CS":
+                if upper == "S":
+                    reflected = (2 * x - control[0], 2 * y - control[1]) if control is not None else (x, y)
+                    arguments = [*reflected, *arguments]
+                commands.append(("curve_to", *arguments))
+                control = arguments[2:4]
+                x, y = arguments[4:6]
+                continue
+            elif upper == "Q":
+                # quadratic curves as the equivalent cubic ones
+                qx, qy, end_x, end_y = arguments
+                commands.append(("curve_to", x + 2 / 3 * (qx - x), y + 2 / 3 * (qy - y),
+                                 end_x + 2 / 3 * (qx - end_x), end_y + 2 / 3 * (qy - end_y), end_x, end_y))
+                x, y = end_x, end_y
+            else:
+                commands.append(("close_path",))
+                x, y = start_x, start_y
+            control = None
+        return commands
+
+    def append_to(self, context):
+        for command, *arguments in self.commands:
+            getattr(context, command)(*arguments)
+
+
+# for path data built at render time; constant paths are better made Paths at class level
+@functools.lru_cache(maxsize=1024)
+def path(d):
+    return Path(d)
+
+@functools.lru_cache(maxsize=64)
+def parse_color(color):
+    color = color.lstrip("#")
+    if len(color) == 3:
+        color = ''.join(digit * 2 for digit in color)
+    return tuple(int(color[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+# A module image drawn with cairo calls instead of an SVG. The calls are
+# recorded first: the recording is the render cache key, and it is only
+# replayed onto a cairo surface when the image isn't cached. Defaults match
+# the SVGs the modules build: round joins, butt caps, a miter limit of 10.
+class Drawing:
+    def __init__(self, width=348, height=348, scale=1):
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.operations = []
+
+    def path(self, d, fill=None, stroke=None, stroke_width=2, fill_opacity=1):
+        self.operations.append(("path", d if isinstance(d, Path) else path(d), fill, stroke, stroke_width, fill_opacity))
+
+    def circle(self, cx, cy, r, fill=None, stroke=None, stroke_width=2):
+        self.operations.append(("circle", cx, cy, r, fill, stroke, stroke_width))
+
+    # size in pt like in the SVGs, anchored like text-anchor
+    def text(self, x, y, text, size, fill="#000", anchor="middle", family="sans-serif", bold=False):
+        self.operations.append(("text", x, y, text, size, fill, anchor, family, bold))
+
+    def key(self):
+        return repr((self.width, self.height, self.scale, self.operations)).encode()
+
+    @staticmethod
+    def paint(context, fill, stroke, stroke_width, fill_opacity=1):
+        if fill is not None:
+            context.set_source_rgba(*parse_color(fill), fill_opacity)
+            if stroke is not None:
+                context.fill_preserve()
+            else:
+                context.fill()
+        if stroke is not None:
+            context.set_source_rgb(*parse_color(stroke))
+            context.set_line_width(stroke_width)
+            context.stroke()
+        context.new_path()
+
+    def draw_path(self, context, path, fill, stroke, stroke_width, fill_opacity):
+        path.append_to(context)
+        Drawing.paint(context, fill, stroke, stroke_width, fill_opacity)
+
+    def draw_circle(self, context, cx, cy, r, fill, stroke, stroke_width):
+        context.new_sub_path()
+        context.arc(cx, cy, r, 0, 2 * math.pi)
+        Drawing.paint(context, fill, stroke, stroke_width)
+
+    def draw_text(self, context, x, y, text, size, fill, anchor, family, bold):
+        context.select_font_face(family, cairocffi.FONT_SLANT_NORMAL, cairocffi.FONT_WEIGHT_BOLD if bold else cairocffi.FONT_WEIGHT_NORMAL)
+        context.set_font_size(size * PT)
+        advance = context.text_extents(text)[4]
+        context.move_to(x - {"start": 0, "middle": advance / 2, "end": advance}[anchor], y)
+        context.set_source_rgb(*parse_color(fill))
+        context.show_text(text)
+        context.new_path()
+
+    def to_png(self):
+        surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, round(self.width * self.scale), round(self.height * self.scale))
+        context = cairocffi.Context(surface)
+        context.scale(self.scale, self.scale)
+        context.set_line_join(cairocffi.LINE_JOIN_ROUND)
+        context.set_line_cap(cairocffi.LINE_CAP_BUTT)
+        context.set_miter_limit(10)
+        for operation, *arguments in self.operations:
+            getattr(self, f"draw_{operation}")(context, *arguments)
+        output = io.BytesIO()
+        surface.write_to_png(output)
+        return output.getvalue()
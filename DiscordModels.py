@@ -1,4 +1,11 @@
-from json import dumps
+import asyncio
+import contextvars
+import config
+import WireProtocol
+
+# While set to (channel, list), replies sent to that channel are collected in the
+# list instead of going out, so several commands can be answered with one message
+capture = contextvars.ContextVar("capture", default=None)
 
 class User:
     def __init__(self, username, discriminator, id, **kwargs):
@@ -12,15 +19,122 @@ class User:
         return self.tag
 
 class Channel:
-    def __init__(self, socket, id, **kwargs):
-        self.socket = socket
+    def __init__(self, registry, id, guild=None, **kwargs):
+        self.registry = registry
+        self.connection = None
         self.id = id
+        self.guild = guild
     
     def __str__(self):
         return str(self.id)
 
     async def send(self, msg, file=None, embed=None):
-        await self.socket.send(dumps({"id":self.id, "message":msg, "file":file, "embed":embed}))
+        frame = {"id":self.id, "message":msg, "file":file, "embed":embed}
+        # a reply the wire protocol can't carry fails here, where it was made
+        WireProtocol.check_reply(frame)
+        captured = capture.get()
+        if captured is not None and captured[0] is self:
+            # stands for the combined message the reply ends up in, once that is sent
+            handle = asyncio.get_event_loop().create_future()
+            captured[1].append((msg, file, embed, handle))
+            return SentMessage(self, handle, combined=True)
+        frame["nonce"], handle = self.registry.new_handle()
+        await self.registry.scheduler.send(self, frame)
+        return SentMessage(self, handle)
+
+    # Sends captured replies as few messages as Discord allows: the text joined,
+    # and up to `max_images` images per message. A reply's handle resolves to
+    # the message it went out in only if nothing else went out in that message,
+    # so editing or deleting it can't take other replies with it.
+    async def send_combined(self, replies, max_length=2000, max_images=10):
+        texts = []
+        # reply index -> indexes of the messages its text and image went out in, and the other way round
+        sent_in = {}
+        contents = {}
+        for index, (msg, _, _, _) in enumerate(replies):
+            if not msg:
+                continue
+            if texts and len(texts[-1]) + 1 + len(str(msg)) <= max_length:
+                texts[-1] += "\n" + str(msg)
+            else:
+                texts.append(str(msg))
+            sent_in.setdefault(index, set()).add(len(texts) - 1)
+            contents.setdefault(len(texts) - 1, set()).add(index)
+        images = []
+        for index, (msg, file, embed, _) in enumerate(replies):
+            if file is None and embed is None:
+                continue
+            sent_in.setdefault(index, set()).add(len(images) // max_images)
+            contents.setdefault(len(images) // max_images, set()).add(index)
+            if file is not None:
+                # every attachment of a message needs its own name
+                filename = f"{len(images)}_{file['filename']}"
+                if embed is not None and embed.get("image") == f"attachment://{file['filename']}":
+                    embed = {**embed, "image": f"attachment://{filename}"}
+                file = {**file, "filename": filename}
+            images.append((file, embed))
+        chunks = [images[i:i + max_images] for i in range(0, len(images), max_images)]
+        handles = []
+        try:
+            for i in range(max(len(texts), len(chunks))):
+                chunk = chunks[i] if i < len(chunks) else []
+                frame = {"id":self.id, "message":texts[i] if i < len(texts) else "", "file":None, "embed":None,
+                         "files":[file for file, _ in chunk if file is not None], "embeds":[embed for _, embed in chunk if embed is not None]}
+                WireProtocol.check_reply(frame)
+                frame["nonce"], handle = self.registry.new_handle()
+                handles.append(handle)
+                await self.registry.scheduler.send(self, frame)
+        finally:
+            for index, (_, _, _, captured) in enumerate(replies):
+                messages = sent_in.get(index, set())
+                message = min(messages, default=None)
+                if len(messages) != 1 or message >= len(handles) or len(contents[message]) > 1:
+                    if not captured.done():captured.set_result(None)
+                else:
+                    handles[message].add_done_callback(lambda done, captured=captured: captured.done() or captured.set_result(done.result()))
+
+# A message posted by Channel.send. Its id arrives from the frontend later, or
+# never if the frontend doesn't support the "handles" capability. A reply
+# captured into a combined message gets the id of that message if it is the
+# only reply in it, and None otherwise.
+class SentMessage:
+    def __init__(self, channel, handle, combined=False):
+        self.channel = channel
+        self.handle = handle
+        self.combined = combined
+
+    async def get_id(self):
+        if self.handle is None:
+            return None
+        # the combined message only goes out once the pipeline capturing it is done
+        if self.combined and not self.handle.done() and capture.get() is not None:
+            return None
+        try:return await asyncio.wait_for(asyncio.shield(self.handle), config.MESSAGE_HANDLE_TIMEOUT)
+        except asyncio.TimeoutError:return None
+
+    async def edit(self, msg=None, file=None, embed=None):
+        message_id = await self.get_id()
+        if message_id is None:
+            return False
+        frame = {"id":self.channel.id, "edit":message_id, "message":msg, "file":file, "embed":embed}
+        WireProtocol.check_reply(frame)
+        await self.channel.registry.scheduler.send(self.channel, frame)
+        return True
+
+    async def delete(self):
+        message_id = await self.get_id()
+        if message_id is None:
+            return False
+        await self.channel.registry.scheduler.send(self.channel, {"id":self.channel.id, "delete":message_id, "message":None, "file":None, "embed":None})
+        return True
+
+    # The emoji goes in the message text of the frame
+    async def add_reaction(self, emoji):
+        message_id = await self.get_id()
+        if message_id is None:
+            return False
+        await self.channel.registry.scheduler.send(self.channel, {"id":self.channel.id, "react":message_id, "message":emoji, "file":None, "embed":None})
+        return True
 
 class Message:
     def __init__(self, author, channel, id, content, **kwargs):
@@ -0,0 +1,124 @@
+import time
+import asyncio
+import traceback
+import contextvars
+from collections import deque
+from Metrics import LatencyHistogram
+
+# tags of the queued commands the running command answers for as well
+coalesced = contextvars.ContextVar("coalesced", default=())
+
+
+# Says what a queued command works on. A command that can `lead` answers every
+# queued command right behind it on the same resource that can `follow`,
+# e.g. one render of a module for several `view` commands. Any other command,
+# on this resource or another one, ends the run of followers, so replies never
+# come out in a different order than the commands came in.
+class Tag:
+    def __init__(self, resource, requester, lead=False, follow=False):
+        self.resource = resource
+        self.requester = requester
+        self.lead = lead
+        self.follow = follow
+
+
+# A class of work with its own concurrency limit, so work in one lane never
+# waits for a slot taken by another lane.
+class Lane:
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queues = {}
+        self.workers = {}
+        self.depth = 0
+        self.max_depth = 0
+        self.running = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.wait_time = LatencyHistogram()
+        self.run_time = LatencyHistogram()
+
+    def stats(self):
+        busiest = sorted(self.queues.items(), key=lambda item: len(item[1]), reverse=True)[:5]
+        return (f"Lane {self.name}: running {self.running}/{self.concurrency}, queued {self.depth} (max {self.max_depth}) in {len(self.queues)} channels, "
+                f"dispatched {self.dispatched}, dropped {self.dropped}\n"
+                f"  wait: {self.wait_time}\n"
+                f"  run:  {self.run_time}\n"
+                f"  deepest queues: {', '.join(f'{channel_id}: {len(queue)}' for channel_id, queue in busiest) or 'none'}")
+
+
+# Runs message handlers in arrival order within a channel and lane, while
+# different channels are handled concurrently (up to each lane's limit).
+# Lanes are independent, so a cheap command in the fast lane can overtake
+# renders queued in the same channel.
+class Dispatcher:
+    def __init__(self, queue_size, lanes, coalesce_window=0, default_lane="default"):
+        self.queue_size = queue_size
+        self.lanes = {name: Lane(name, concurrency) for name, concurrency in lanes.items()}
+        self.coalesce_window = coalesce_window
+        self.default_lane = default_lane
+        self.coalesced = 0
+        # picks the lane, tag and cost classes of a message, registered by main
+        self.classify = lambda message: (default_lane, None, ("text",))
+
+    def submit(self, channel, handler, lane=None, tag=None):
+        lane = self.lanes.get(lane) or self.lanes[self.default_lane]
+        queue = lane.queues.get(channel.id)
+        if queue is None:
+            queue = lane.queues[channel.id] = deque()
+        if len(queue) >= self.queue_size:
+            lane.dropped += 1
+            return False
+
+        queue.append((time.monotonic(), handler, tag))
+        lane.depth += 1
+        lane.max_depth = max(lane.max_depth, lane.depth)
+        if channel.id not in lane.workers:
+            lane.workers[channel.id] = asyncio.ensure_future(self._drain(lane, channel.id, queue))
+        return True
+
+    async def _drain(self, lane, channel_id, queue):
+        try:
+            while queue:
+                async with lane.semaphore:
+                    queued_at, handler, tag = queue.popleft()
+                    followers = self.take_followers(queue, queued_at, tag)
+                    lane.depth -= 1 + len(followers)
+                    self.coalesced += len(followers)
+                    started_at = time.monotonic()
+                    for item_queued_at, _, _ in [(queued_at, handler, tag), *followers]:
+                        lane.wait_time.record(started_at - item_queued_at)
+                    lane.running += 1
+                    token = coalesced.set(tuple(follower_tag for _, _, follower_tag in followers))
+                    try:
+                        await handler()
+                    except Exception:
+                        print(f"Exception in dispatcher for {channel_id}:\n{traceback.format_exc()}")
+                    finally:
+                        coalesced.reset(token)
+                        lane.running -= 1
+                        lane.dispatched += 1 + len(followers)
+                        lane.run_time.record(time.monotonic() - started_at)
+        finally:
+            del lane.workers[channel_id]
+            if not queue:
+                del lane.queues[channel_id]
+
+    def take_followers(self, queue, queued_at, tag):
+        if tag is None or not tag.lead or self.coalesce_window <= 0:
+            return []
+        followers = []
+        for item in queue:
+            item_queued_at, _, item_tag = item
+            if (item_tag is None or item_tag.resource is not tag.resource or not item_tag.follow
+                    or item_queued_at - queued_at > self.coalesce_window):
+                break
+            followers.append(item)
+        for item in followers:
+            queue.remove(item)
+        return followers
+
+    def stats(self):
+        return '\n'.join([*(lane.stats() for lane in self.lanes.values()),
+                          f"Coalesced: {self.coalesced} commands answered together with an earlier one (window {self.coalesce_window}s)"])
@@ -1,33 +1,576 @@
 from DiscordModels import *
-from json import loads
+from Dispatcher import Dispatcher
+from Metrics import RateMeter
+from RateLimit import SendScheduler, CommandLimiter
+from Retention import FileCounter
+from collections import deque, OrderedDict
+from json import loads, dumps
+import os
+import time
+import secrets
 import asyncio
 import websockets
 import config
+import WireProtocol
 
 
 host = config.HOST
 port = config.PORT
+RenderOut = f"{os.path.dirname(os.path.realpath(__file__))}/rendered"
+if not os.path.isdir(RenderOut):os.mkdir(RenderOut)
+spill_counter = FileCounter(f"{RenderOut}/.next")
 
 def OnMessage(func):
     global Func_OnMessage
     Func_OnMessage = func
     return func
 
-ChannelCache = {}
+# Registers a check for channels that must stay cached, such as ones with a
+# bomb. A channel is kept while any of the checks says so.
+def KeepChannel(func):
+    ChannelCache.keepers.append(func)
+    return func
 
-async def HandleSocket(websocket, path):
-    print("Main bot connected")
-    while True:
-        try:data = loads(await websocket.recv())
-        except Exception as e:
-            print(f"Error: {str(e)}")
+# Registers the function that picks the dispatcher lane, tag and cost classes of a message
+def ClassifyMessage(func):
+    dispatcher.classify = func
+    return func
+
+# Frontends that can't take binary attachments read the file back from disk.
+# Every file gets a path of its own, since the frontend may not have read the
+# previous one with the same name yet.
+def spill_attachment(file):
+    path = f"{RenderOut}/{spill_counter.allocate()}-{file['filename']}"
+    with open(path, "wb") as out:out.write(file["data"])
+    return {"path":path, "filename":file["filename"]}
+
+# A combined reply as one message per image, for frontends that can only post
+# one image per message
+def split_combined(frame):
+    files, embeds = frame["files"], frame["embeds"]
+    parts = []
+    for i in range(max(len(files), len(embeds), 1)):
+        part = {"id": frame["id"], "message": frame["message"] if i == 0 else "",
+                "file": files[i] if i < len(files) else None, "embed": embeds[i] if i < len(embeds) else None}
+        # every part acknowledges the same sequence number, the first one stands for the message handle
+        if "seq" in frame:
+            part["seq"] = frame["seq"]
+        if i == 0 and "nonce" in frame:
+            part["nonce"] = frame["nonce"]
+        parts.append(part)
+    return parts
+
+# A single frontend (KTaNE Bot process or shard) connected to the simulator
+class Connection:
+    # optional protocol features a frontend can ask for in its hello message
+    CAPABILITIES = {"batch", "attachments", "resume", "handles", "multi"}
+    PROTOCOLS = {"json", WireProtocol.NAME}
+
+    def __init__(self, registry, id, socket):
+        self.registry = registry
+        self.id = id
+        self.socket = socket
+        self.channels = set()
+        self.capabilities = set()
+        self.protocol = "json"
+        self.connected_at = time.monotonic()
+        self.closed = False
+        self.outbox = asyncio.Queue(maxsize=config.OUTBOUND_QUEUE_SIZE)
+        self.frames = RateMeter()
+        self.bytes = RateMeter()
+        self.writes = RateMeter()
+        self.blocked = 0
+        # replies that couldn't be encoded
+        self.dropped = 0
+        # With "resume", every reply gets the next sequence number (the "seq" key in
+        # JSON, its position in the stream with the binary protocol) and is kept until
+        # the frontend acknowledges it, so it can be replayed after a reconnect.
+        self.token = secrets.token_urlsafe(16)
+        self.seq = 0
+        self.acked = 0
+        self.replay = deque()
+        # sequence number of the last reply written to the socket
+        self.written = 0
+        self.replaying = False
+        self.replayed = 0
+        self.lost = 0
+        self.detached_at = None
+        self.writer = asyncio.ensure_future(self.write_loop())
+
+    def __str__(self):
+        return f"#{self.id} ({getattr(self.socket, 'remote_address', None) or 'unknown address'})"
+
+    def hello(self, requested):
+        self.capabilities = {name for name, wanted in requested.items() if wanted and name in Connection.CAPABILITIES}
+        # "protocol" lists the wire formats the frontend speaks, in order of preference
+        offered = requested.get("protocol", ["json"])
+        self.protocol = next((protocol for protocol in offered if protocol in Connection.PROTOCOLS), "json")
+        reply = {"connection": self.id, "capabilities": sorted(self.capabilities), "protocol": self.protocol}
+        if "resume" in self.capabilities:
+            reply["session"] = self.token
+        return {"hello": reply}
+
+    def decode(self, raw):
+        if isinstance(raw, str):
+            return [loads(raw)]
+        if self.protocol != WireProtocol.NAME:
+            raise WireProtocol.ProtocolError("binary message before the binary protocol was negotiated")
+        return WireProtocol.decode_messages(raw)
+
+    async def send(self, channel, frame):
+        if channel is not None and "resume" in self.capabilities:
+            frame = self.remember(channel, frame)
+            # goes out with the replay once the frontend is back
+            if self.detached_at is not None or self.replaying:
+                return
+        # Waiting here when the outbox is full slows producers down to the
+        # speed of the frontend instead of piling frames up in memory.
+        if self.outbox.full():
+            self.blocked += 1
+        await self.outbox.put((channel, frame))
+        if self.closed:
+            self.registry.redeliver(self.drain())
+
+    def remember(self, channel, frame):
+        self.seq += 1
+        frame = {**frame, "seq": self.seq}
+        self.replay.append((channel, frame))
+        if len(self.replay) > config.REPLAY_BUFFER_SIZE:
+            self.replay.popleft()
+            self.lost += 1
+        return frame
+
+    def ack(self, seq):
+        self.acked = max(self.acked, min(seq, self.seq))
+        while self.replay and self.replay[0][1]["seq"] <= self.acked:
+            self.replay.popleft()
+
+    # Whether every reply after `seq` is still in the replay buffer. Replaying
+    # around a gap would shift the position of every later binary reply.
+    def can_resume(self, seq):
+        self.ack(seq)
+        return self.acked == self.seq or (bool(self.replay) and self.replay[0][1]["seq"] == self.acked + 1)
+
+    # Replies that never left the simulator. The ones written to the socket but
+    # not acknowledged may have been posted already, so they are not sent again
+    # through another connection.
+    def unsent(self):
+        return [(channel, frame) for channel, frame in self.replay if frame["seq"] > self.written]
+
+    def detach(self):
+        self.writer.cancel()
+        # everything still queued is in the replay buffer as well
+        self.drain()
+        self.socket = None
+        self.detached_at = time.monotonic()
+
+    def attach(self, socket):
+        # senders that were waiting for room in the outbox put their replies there
+        # after detach() emptied it, they go out with the replay
+        self.drain()
+        self.socket = socket
+        self.detached_at = None
+        self.replaying = True
+        self.connected_at = time.monotonic()
+        self.writer = asyncio.ensure_future(self.write_loop())
+
+    async def replay_from(self, seq):
+        self.ack(seq)
+        last = self.acked
+        try:
+            # replies sent while the replay waits for room in the outbox are picked up by the next pass
+            while self.detached_at is None:
+                frames = [(channel, frame) for channel, frame in self.replay if frame["seq"] > last]
+                if not frames:
+                    break
+                for channel, frame in frames:
+                    if self.detached_at is not None:
+                        break
+                    await self.outbox.put((channel, frame))
+                    last = frame["seq"]
+                    self.replayed += 1
+        finally:
+            self.replaying = False
+
+    def drain(self):
+        frames = []
+        while not self.outbox.empty():
+            frames.append(self.outbox.get_nowait())
+        return frames
+
+    def close(self):
+        self.closed = True
+        self.writer.cancel()
+        return self.drain()
+
+    # The payloads to send for a batch, each with the batch entries that have
+    # been delivered in full once it is sent
+    async def encode(self, batch):
+        binary = self.protocol == WireProtocol.NAME
+        frames = []
+        attachments = []
+        for entry in batch:
+            frame = entry[1]
+            if frame.get("nonce") is not None and "handles" not in self.capabilities:
+                # this frontend never tells us the message id
+                self.registry.resolve(frame["nonce"], None)
+                frame = {key: value for key, value in frame.items() if key != "nonce"}
+            if binary:
+                frames.append((entry, frame))
+                continue
+            parts = [frame] if "files" not in frame or "multi" in self.capabilities else split_combined(frame)
+            for frame in parts:
+                if frame.get("file") is not None:
+                    frame = {**frame, "file": await self.encode_file(frame["file"], attachments)}
+                if frame.get("files"):
+                    frame = {**frame, "files": [await self.encode_file(file, attachments) for file in frame["files"]]}
+                frames.append((entry, frame))
+
+        if binary:
+            # control messages such as the hello reply stay JSON
+            payloads = [(dumps(frame), [entry]) for entry, frame in frames if "id" not in frame]
+            replies = [(entry, frame) for entry, frame in frames if "id" in frame]
+            if replies:
+                payloads.append((WireProtocol.encode_replies([frame for _, frame in replies]), [entry for entry, _ in replies]))
+            return payloads
+        message = dumps(frames[0][1] if len(frames) == 1 else {"batch": [frame for _, frame in frames]})
+        # a reply is only complete once the attachments following it are sent too
+        payloads = [(payload, []) for payload in [message, *attachments]]
+        payloads[-1] = (payloads[-1][0], list(batch))
+        return payloads
+
+    async def encode_file(self, file, attachments):
+        if "data" not in file:
+            return file
+        if "attachments" in self.capabilities:
+            # the image follows the JSON message as a binary message of its own
+            attachments.append(file["data"])
+            return {"filename": file["filename"], "size": len(file["data"]), "binary": True}
+        return await asyncio.get_event_loop().run_in_executor(None, spill_attachment, file)
+
+    # Encodes the frames one by one, leaving out the ones that fail
+    async def encode_each(self, batch):
+        payloads = []
+        for channel, frame in batch:
+            try:
+                payloads.extend(await self.encode([(channel, frame)]))
+            except Exception as e:
+                print(f"Dropped a reply to {channel} for frontend {self} that could not be encoded: {str(e)}")
+                self.discard(frame)
+        return payloads
+
+    # A reply that is never going to be sent. With the binary protocol a
+    # reply's sequence number is its position in the stream, so the ones
+    # after it move up a place.
+    def discard(self, frame):
+        self.dropped += 1
+        if frame.get("nonce") is not None:
+            self.registry.resolve(frame["nonce"], None)
+        if "seq" not in frame:
+            return
+        self.replay = deque((channel, replayed) for channel, replayed in self.replay if replayed is not frame)
+        for _, replayed in self.replay:
+            if replayed["seq"] > frame["seq"]:
+                replayed["seq"] -= 1
+        self.seq -= 1
+
+    async def write_loop(self):
+        while True:
+            # everything queued by the time the writer wakes up goes out in one write
+            batch = [await self.outbox.get()]
+            if "batch" in self.capabilities or self.protocol == WireProtocol.NAME:
+                while len(batch) < config.OUTBOUND_MAX_BATCH and not self.outbox.empty():
+                    batch.append(self.outbox.get_nowait())
+
+            try:
+                payloads = await self.encode(batch)
+            except Exception:
+                # one reply that can't be encoded mustn't take the others or the writer down with it
+                payloads = await self.encode_each(batch)
+            sent = []
+            try:
+                for payload, delivered in payloads:
+                    await self.socket.send(payload)
+                    sent.extend(delivered)
+            except Exception as e:
+                print(f"Frontend {self} went away while sending: {str(e)}")
+                # only what didn't make it is delivered again
+                self.wrote(sent)
+                self.registry.unregister(self, [entry for entry in batch if not any(entry is done for done in sent)])
+                return
+            self.wrote(batch)
+            self.frames.record(len(batch))
+            self.bytes.record(sum(len(payload) for payload, _ in payloads))
+            self.writes.record()
+
+    def wrote(self, batch):
+        self.written = max([self.written, *(frame["seq"] for _, frame in batch if "seq" in frame)])
+
+    def stats(self):
+        return (f"{self}: {len(self.channels)} channels, protocol {self.protocol}, capabilities: {', '.join(sorted(self.capabilities)) or 'none'}, up {time.monotonic() - self.connected_at:.0f}s\n"
+                f"  outbox {self.outbox.qsize()}/{self.outbox.maxsize}, blocked senders: {self.blocked}, "
+                f"{self.frames.rate():.1f} frames/s, {self.writes.rate():.1f} writes/s, {self.bytes.rate() / 1024:.1f} KiB/s, "
+                f"{self.frames.total} frames / {self.bytes.total} bytes total, dropped {self.dropped}"
+                + (f"\n  session: seq {self.seq}, acked {self.acked}, replay buffer {len(self.replay)}/{config.REPLAY_BUFFER_SIZE}, "
+                   f"replayed {self.replayed}, lost {self.lost}" if "resume" in self.capabilities else ""))
+
+
+class ConnectionRegistry:
+    def __init__(self, pending_limit):
+        self.connections = {}
+        self.next_id = 1
+        self.pending_limit = pending_limit
+        # frames for channels that couldn't be routed anywhere, keyed by channel
+        self.pending = {}
+        # frontends that went away but may still resume, keyed by session token
+        self.detached = {}
+        # sent messages waiting for the frontend to report their id, keyed by nonce
+        self.handles = OrderedDict()
+        self.next_nonce = 1
+        self.scheduler = SendScheduler(self, config.CHANNEL_SEND_RATE, config.CHANNEL_SEND_BURST)
+
+    def register(self, socket):
+        connection = Connection(self, self.next_id, socket)
+        self.next_id += 1
+        self.connections[connection.id] = connection
+        for channel in list(self.pending):
+            asyncio.ensure_future(self.flush(channel))
+        return connection
+
+    def unregister(self, connection, unsent=()):
+        if self.connections.pop(connection.id, None) is None:
+            return
+        if "resume" in connection.capabilities:
+            # keep its channels and replies around for a while, unsent ones are in the replay buffer
+            connection.detach()
+            self.detached[connection.token] = connection
+            asyncio.get_event_loop().call_later(config.SESSION_RESUME_TIMEOUT, self.expire, connection, connection.detached_at)
+            return
+        self.drop(connection, [*unsent, *connection.close()])
+
+    def expire(self, connection, detached_at):
+        if self.detached.get(connection.token) is not connection or connection.detached_at != detached_at:
+            return
+        del self.detached[connection.token]
+        print(f"Session of frontend {connection} expired")
+        self.end_session(connection)
+
+    def end_session(self, connection):
+        connection.close()
+        self.drop(connection, connection.unsent())
+
+    async def hello(self, connection, requested):
+        session = self.detached.pop(requested.get("resume"), None)
+        if session is not None and not session.can_resume(requested.get("ack", 0)):
+            # the frontend starts over with a new session instead
+            print(f"Frontend {session} missed replies that are no longer buffered, refusing to resume its session")
+            self.end_session(session)
+            session = None
+        if session is not None:
+            # the new socket takes over the old session
+            self.connections.pop(connection.id, None)
+            self.redeliver(connection.close())
+            self.connections[session.id] = session
+            session.attach(connection.socket)
+            print(f"Frontend {session} resumed its session")
+            connection = session
+        reply = connection.hello(requested)
+        if "resume" in connection.capabilities:
+            reply["hello"]["resumed"] = session is not None
+        await connection.send(None, reply)
+        if session is not None:
+            await session.replay_from(requested.get("ack", 0))
+        return connection
+
+    def new_handle(self):
+        nonce = self.next_nonce
+        self.next_nonce += 1
+        handle = asyncio.get_event_loop().create_future()
+        self.handles[nonce] = handle
+        if len(self.handles) > config.PENDING_MESSAGE_HANDLES:
+            _, oldest = self.handles.popitem(last=False)
+            if not oldest.done():oldest.set_result(None)
+        return nonce, handle
+
+    def resolve(self, nonce, message_id):
+        handle = self.handles.pop(nonce, None)
+        if handle is not None and not handle.done():
+            handle.set_result(message_id)
+
+    # the message `nonce` turned out to be part of the message `target`
+    def alias(self, nonce, target):
+        handle = self.handles.pop(nonce, None)
+        if handle is None:
             return
-        data["channel"]["socket"]=websocket
-        ChannelID = data["channel"]["id"]
-        channel = ChannelCache[ChannelID] if ChannelID in ChannelCache else Channel(**data["channel"])
-        channel.socket = websocket
-        ChannelCache[ChannelID]=channel
-        await Func_OnMessage(Message(User(**data["author"]), channel, **data["message"]))
+        target_handle = self.handles.get(target)
+        if target_handle is None:
+            if not handle.done():handle.set_result(None)
+        else:
+            target_handle.add_done_callback(lambda done: handle.done() or handle.set_result(done.result()))
+
+    def drop(self, connection, frames):
+        for channel_id in connection.channels:
+            channel = ChannelCache.get(channel_id)
+            if channel is not None and channel.connection is connection:
+                channel.connection = None
+        connection.channels.clear()
+        self.redeliver(frames)
+
+    def redeliver(self, frames):
+        for channel, frame in frames:
+            if channel is not None:
+                asyncio.ensure_future(self.deliver(channel, frame))
+
+    def bind(self, channel, connection):
+        if channel.connection is not connection:
+            if channel.connection is not None:
+                channel.connection.channels.discard(channel.id)
+            channel.connection = connection
+            connection.channels.add(channel.id)
+        if channel in self.pending:
+            asyncio.ensure_future(self.flush(channel))
+
+    def route(self, channel):
+        if channel.connection is not None and (channel.connection.id in self.connections or self.detached.get(channel.connection.token) is channel.connection):
+            return channel.connection
+        # Any frontend can post to any channel, so fall back to the least busy one
+        # until the channel's own frontend reconnects.
+        if not self.connections:
+            return None
+        return min(self.connections.values(), key=lambda connection: len(connection.channels))
+
+    async def deliver(self, channel, frame):
+        connection = self.route(channel)
+        if connection is None:
+            if channel not in self.pending:
+                self.pending[channel] = deque(maxlen=self.pending_limit)
+            self.pending[channel].append(frame)
+        else:
+            await connection.send(channel, frame)
+
+    async def flush(self, channel):
+        frames = self.pending.pop(channel, None)
+        while frames:
+            await self.deliver(channel, frames.popleft())
+
+    def stats(self):
+        lines = [connection.stats() for connection in self.connections.values()]
+        lines.extend(f"{connection} (detached {time.monotonic() - connection.detached_at:.0f}s ago): {len(connection.channels)} channels, {len(connection.replay)} replies to replay"
+                     for connection in self.detached.values())
+        lines.append(f"Undeliverable frames waiting: {sum(map(len, self.pending.values()))} in {len(self.pending)} channels")
+        lines.append(f"Messages waiting for their id: {len(self.handles)}")
+        return '\n'.join(lines)
+
+
+# Least recently used channels are dropped once there are too many of them or
+# they have been idle for too long, unless something still needs them.
+class ChannelLRU:
+    def __init__(self, max_size, idle_ttl):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.channels = OrderedDict()
+        self.keepers = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.channels)
+
+    def get(self, channel_id):
+        entry = self.channels.get(channel_id)
+        return entry[0] if entry is not None else None
+
+    def lookup(self, channel_id):
+        entry = self.channels.get(channel_id)
+        if entry is None:
+            self.misses += 1
+            channel = None
+        else:
+            self.hits += 1
+            channel = entry[0]
+            self.channels[channel_id] = channel, time.monotonic()
+            self.channels.move_to_end(channel_id)
+        self.evict()
+        return channel
+
+    def add(self, channel):
+        self.channels[channel.id] = channel, time.monotonic()
+        self.evict()
+        return channel
+
+    def evict(self):
+        now = time.monotonic()
+        # every entry is looked at most once, kept channels are treated as just used
+        for _ in range(len(self.channels)):
+            channel_id, (channel, last_used) = next(iter(self.channels.items()))
+            if len(self.channels) <= self.max_size and now - last_used < self.idle_ttl:
+                break
+            if any(keep(channel) for keep in self.keepers) or channel in connections.pending:
+                self.channels[channel_id] = channel, now
+                self.channels.move_to_end(channel_id)
+                continue
+            del self.channels[channel_id]
+            if channel.connection is not None:
+                channel.connection.channels.discard(channel_id)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return (f"Cached channels: {len(self.channels)}/{self.max_size}, idle TTL {self.idle_ttl}s\n"
+                f"Hits: {self.hits}, misses: {self.misses} ({self.hits / lookups * 100 if lookups else 0:.1f}% hit rate), evictions: {self.evictions}")
+
+
+ChannelCache = ChannelLRU(config.CHANNEL_CACHE_SIZE, config.CHANNEL_IDLE_TTL)
+connections = ConnectionRegistry(config.PENDING_FRAMES_PER_CHANNEL)
+dispatcher = Dispatcher(config.CHANNEL_QUEUE_SIZE, config.DISPATCH_LANES, config.VIEW_COALESCE_WINDOW)
+limiter = CommandLimiter(config.USER_COMMAND_BUDGET, config.CHANNEL_COMMAND_BUDGET, config.COMMAND_COSTS)
+
+async def HandleSocket(websocket, path):
+    connection = connections.register(websocket)
+    print(f"Main bot connected: {connection}")
+    try:
+        while True:
+            try:raw = await websocket.recv()
+            except Exception as e:
+                print(f"Error: {str(e)}")
+                return
+            try:messages = connection.decode(raw)
+            except (ValueError, KeyError, WireProtocol.ProtocolError) as e:
+                print(f"Malformed message from {connection}: {str(e)}")
+                continue
+            for data in messages:
+                if "hello" in data:
+                    connection = await connections.hello(connection, data["hello"])
+                    continue
+                if "ack" in data:
+                    connection.ack(data["ack"])
+                    continue
+                if "sent" in data:
+                    connections.resolve(data["sent"]["nonce"], data["sent"]["id"])
+                    continue
+                ChannelID = data["channel"]["id"]
+                channel = ChannelCache.lookup(ChannelID)
+                if channel is None:
+                    channel = ChannelCache.add(Channel(connections, **data["channel"]))
+                connections.bind(channel, connection)
+                message = Message(User(**data["author"]), channel, **data["message"])
+                lane, tag, costs = dispatcher.classify(message)
+                throttled = limiter.admit(message.author.id, channel.id, costs)
+                if throttled is not None:
+                    who, delay, warn = throttled
+                    if delay is None:
+                        await channel.send(f"{message.author.mention} That is more work than can be done for one message. Split the commands into several messages.")
+                        continue
+                    if warn:await channel.send(f"{message.author.mention} {'You are' if who == 'user' else 'This channel is'} sending commands faster than the bot can keep up with. Try again in {delay:.0f} seconds.")
+                    continue
+                if not dispatcher.submit(channel, lambda message=message: Func_OnMessage(message), lane, tag):
+                    await channel.send(f"{message.author.mention} Slow down! Too many commands are already waiting in this channel.")
+    finally:
+        print(f"Main bot disconnected: {connection}")
+        # a resumed session may already be running on a newer socket
+        if connection.socket is websocket:
+            connections.unregister(connection)
 
 
 def Start():
@@ -0,0 +1,126 @@
+import time
+import threading
+from wand.image import Image
+
+EXTENSIONS = {"png": "png", "palette": "png", "webp": "webp"}
+
+
+# Re-encodes rendered PNGs before they are uploaded. Module images only
+# have a few flat colours, so an indexed-palette PNG or a lossless WebP is
+# usually much smaller than the RGBA PNG cairo writes. Each module type
+# tries every format in `formats` on its first `trials` images and then
+# sticks to the one with the best goal: "smallest" for the fewest bytes,
+# "fastest" for the least encoding time plus upload time at `bandwidth`
+# bytes a second.
+class ImageEncoder:
+    def __init__(self, formats, goal, trials, png_compression, webp_method, bandwidth, cache):
+        self.formats = formats
+        self.goal = goal
+        self.trials = trials
+        self.png_compression = png_compression
+        self.webp_method = webp_method
+        self.bandwidth = bandwidth
+        # RenderCache the encoded images are kept in, keyed by the PNG
+        self.cache = cache
+        # module type -> format it settled on
+        self.chosen = {}
+        # (module type, format) -> [images, bytes, seconds], measured during the trials
+        self.samples = {}
+        # trial results not handed to the main process yet, when this is a render worker
+        self.new_samples = []
+        self.lock = threading.Lock()
+        self.counts = {"rendered_bytes": 0, "encoded_bytes": 0}
+        # counted in render worker processes and handed over with the finished image
+        self.merged = {"rendered_bytes": 0, "encoded_bytes": 0}
+
+    # effort scales the compression settings, from 1 for the configured ones down to 0 for the fastest.
+    # PNG compression doesn't drop to level 0, which stores the image uncompressed, unless it is configured to.
+    def encode_as(self, format, png, effort=1):
+        if format == "png":
+            return png
+        with Image(blob=png, format="png") as im:
+            if format == "palette":
+                im.options["png:compression-level"] = str(max(min(self.png_compression, 1), round(self.png_compression * effort)))
+                # ImageMagick's PNG8 reduces the image to at most 256 colours itself
+                return im.make_blob("png8")
+            im.options["webp:lossless"] = "true"
+            im.options["webp:method"] = str(round(self.webp_method * effort))
+            return im.make_blob("webp")
+
+    def score(self, images, size, seconds):
+        if self.goal == "fastest":
+            return (seconds + size / self.bandwidth) / images
+        return size / images
+
+    def best(self, module_name):
+        with self.lock:
+            measured = [(self.score(*self.samples[module_name, format]), format) for format in self.formats if (module_name, format) in self.samples]
+        return min(measured)[1] if measured else self.formats[0]
+
+    def trial(self, module_name, png):
+        results = {}
+        for format in self.formats:
+            start = time.perf_counter()
+            results[format] = self.encode_as(format, png)
+            sample = (module_name, format, len(results[format]), time.perf_counter() - start)
+            self.record(*sample)
+            with self.lock:
+                self.new_samples.append(sample)
+        format = self.best(module_name)
+        return format, results[format]
+
+    def record(self, module_name, format, size, seconds):
+        with self.lock:
+            sample = self.samples.setdefault((module_name, format), [0, 0, 0.0])
+            sample[0] += 1
+            sample[1] += size
+            sample[2] += seconds
+        format = self.best(module_name)
+        if self.samples[module_name, format][0] >= self.trials:
+            self.chosen[module_name] = format
+
+    # The image to upload and its file extension. Renders at reduced effort
+    # are left out of the trials and kept as they are until a format is chosen.
+    def encode(self, module_name, png, effort=1):
+        format = self.chosen.get(module_name)
+        if format is None and effort < 1:
+            format, data = "png", png
+        elif format is None:
+            format, data = self.trial(module_name, png)
+        elif format == "png":
+            data = png
+        else:
+            data = self.cache.svg2png(lambda png, **_: self.encode_as(format, png, effort), png, encoded=format, effort=effort)
+        with self.lock:
+            self.counts["rendered_bytes"] += len(png)
+            self.counts["encoded_bytes"] += len(data)
+        return data, EXTENSIONS[format]
+
+    # Counts since the last call, for a render worker to send back
+    def take_counts(self):
+        with self.lock:
+            counts, self.counts = self.counts, dict.fromkeys(self.counts, 0)
+            samples, self.new_samples = self.new_samples, []
+        return counts, samples
+
+    def merge(self, counts):
+        counts, samples = counts
+        for name, count in counts.items():
+            self.merged[name] += count
+        for sample in samples:
+            self.record(*sample)
+
+    def stats(self):
+        rendered = self.counts["rendered_bytes"] + self.merged["rendered_bytes"]
+        encoded = self.counts["encoded_bytes"] + self.merged["encoded_bytes"]
+        lines = [f"Formats: {', '.join(self.formats)}, goal: {self.goal}, {self.trials} trial images per module type\n"
+                 f"Encoded {rendered / 1024 / 1024:.1f} MiB of PNGs into {encoded / 1024 / 1024:.1f} MiB"
+                 + (f" ({encoded / rendered * 100:.0f}%)" if rendered else "")]
+        with self.lock:
+            module_names = sorted({module_name for module_name, _ in self.samples})
+            for module_name in module_names:
+                measured = ', '.join(f"{format} {size / images / 1024:.1f} KiB in {seconds / images * 1000:.1f}ms"
+                                     for format in self.formats if (module_name, format) in self.samples
+                                     for images, size, seconds in [self.samples[module_name, format]])
+                lines.append(f"{module_name}: {self.chosen.get(module_name, 'trying')} ({measured})")
+        return '\n'.join(lines)
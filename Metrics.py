@@ -0,0 +1,61 @@
+import time
+import bisect
+from collections import deque
+
+
+class LatencyHistogram:
+    # upper bounds of the buckets, in seconds
+    BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.buckets[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        # upper bound of the bucket the p-th percentile falls into
+        if not self.count:
+            return 0.0
+        threshold = self.count * p / 100
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.buckets):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return self.max
+
+    def __str__(self):
+        if not self.count:
+            return "n=0"
+        return (f"n={self.count} avg={self.total / self.count * 1000:.1f}ms "
+                f"p50<={self.percentile(50) * 1000:g}ms p99<={self.percentile(99) * 1000:g}ms "
+                f"max={self.max * 1000:.1f}ms")
+
+
+class RateMeter:
+    def __init__(self, window=10):
+        self.window = window
+        self.events = deque()
+        self.total = 0
+
+    def record(self, amount=1):
+        now = time.monotonic()
+        self.events.append((now, amount))
+        self.total += amount
+        self._expire(now)
+
+    def _expire(self, now):
+        while self.events and self.events[0][0] < now - self.window:
+            self.events.popleft()
+
+    def rate(self):
+        self._expire(time.monotonic())
+        return sum(amount for _, amount in self.events) / self.window
@@ -0,0 +1,121 @@
+import asyncio
+import traceback
+from collections import OrderedDict
+from Metrics import RateMeter
+
+
+# What is known about the next render of one module: the predicted states
+# that haven't been rendered yet and the render keys (Module.render_key) of
+# those that have
+class Prediction:
+    def __init__(self, successors):
+        self.pending = list(successors)
+        self.keys = set()
+
+
+# Renders the states modules are likely to be in next (see
+# Module.predict_successors) while the renderer has nothing else to do, so
+# the render the next command needs is already in the render cache. Only
+# the most recently shown modules are predicted for, and at most `budget`
+# renders a minute are spent on it. Each state is rendered with the quality
+# settings the view showing it would get: strikes and solves are shown as
+# "critical" and everything else as "command". A prediction hits when the
+# next image shown of the module has the render key of a predicted one.
+class Prerenderer:
+    def __init__(self, renderer, budget, max_modules, poll_interval=0.1):
+        self.renderer = renderer
+        self.budget = budget
+        self.max_modules = max_modules
+        self.poll_interval = poll_interval
+        # module -> Prediction, least recently shown first
+        self.predictions = OrderedDict()
+        # module -> snapshot of its latest view
+        self.latest = {}
+        self.wake = asyncio.Event()
+        self.meter = RateMeter(60)
+        self.rendered = 0
+        self.dropped = 0
+        self.failed = 0
+        self.hits = 0
+        self.misses = 0
+
+    # Called with every image shown of a module, with the (scale, effort) it was
+    # rendered at. Working out the render key and the successors builds and
+    # copies module state, so that runs in the render threads.
+    async def shown(self, module, snapshot, strike, settings):
+        self.latest[module] = snapshot
+        prediction = self.predictions.pop(module, None)
+        try:
+            if prediction is not None:
+                self.dropped += len(prediction.pending)
+                if prediction.keys:
+                    if await self.renderer.offload(snapshot.render_key, strike, *settings) in prediction.keys:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+            if self.budget <= 0 or snapshot.solved:
+                return
+            successors = await self.renderer.offload(snapshot.predict_successors)
+        except Exception:
+            self.failed += 1
+            print(f"Predicting what follows {snapshot} failed:\n{traceback.format_exc()}")
+            return
+        # a later view of the module, or the end of its bomb, came in the meantime
+        if not successors or self.latest.get(module) is not snapshot:
+            return
+        self.predictions[module] = Prediction(successors)
+        while len(self.predictions) > self.max_modules:
+            _, prediction = self.predictions.popitem(last=False)
+            self.dropped += len(prediction.pending)
+        self.wake.set()
+
+    def forget(self, module):
+        self.latest.pop(module, None)
+        prediction = self.predictions.pop(module, None)
+        if prediction is not None:
+            self.dropped += len(prediction.pending)
+
+    # The most recently shown module's next state to render
+    def next_job(self):
+        for module, prediction in reversed(self.predictions.items()):
+            if prediction.pending:
+                return prediction, *prediction.pending.pop(0)
+        return None
+
+    async def run(self):
+        while True:
+            await self.wake.wait()
+            if not any(prediction.pending for prediction in self.predictions.values()):
+                self.wake.clear()
+                continue
+            if not self.renderer.idle() or self.meter.rate() * self.meter.window >= self.budget:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            prediction, snapshot, strike = self.next_job()
+            self.meter.record()
+            quality = "critical" if strike or snapshot.solved else "command"
+            try:
+                _, _, _, settings = await self.renderer.render(snapshot, strike, "speculative", quality)
+            except Exception:
+                self.failed += 1
+                print(f"Prerendering {snapshot} failed:\n{traceback.format_exc()}")
+                continue
+            self.rendered += 1
+            try:
+                key = await self.renderer.offload(snapshot.render_key, strike, *settings)
+            except Exception:
+                self.failed += 1
+                print(f"Prerendering {snapshot} failed:\n{traceback.format_exc()}")
+                continue
+            if key is not None:
+                prediction.keys.add(key)
+
+    def stats(self):
+        if self.budget <= 0:
+            return "Off"
+        predicted = self.hits + self.misses
+        hit_rate = self.hits / predicted * 100 if predicted else 0
+        return (f"Rendered ahead: {self.rendered} ({self.meter.rate() * self.meter.window:.0f}/{self.budget:g} in the last minute), "
+                f"waiting: {sum(len(prediction.pending) for prediction in self.predictions.values())} for {len(self.predictions)}/{self.max_modules} modules, "
+                f"dropped: {self.dropped}, failed: {self.failed}\n"
+                f"Hit rate: {hit_rate:.1f}% of {predicted} views that had predictions ({self.hits} hits, {self.misses} misses)")
@@ -0,0 +1,185 @@
+import time
+import asyncio
+import weakref
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount=1):
+        self.refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    # spends tokens even if there aren't enough, later takes wait for the debt to be paid
+    def force(self, amount=1):
+        self.refill()
+        self.tokens = max(self.tokens - amount, -self.burst)
+
+    # seconds until `amount` tokens are available
+    def delay(self, amount=1):
+        self.refill()
+        return max(0, (amount - self.tokens) / self.rate)
+
+
+# Limits how much work each user and each channel can queue, weighted by
+# what the command costs to answer
+class CommandLimiter:
+    def __init__(self, user_budget, channel_budget, costs, sweep_interval=60):
+        self.user_budget = user_budget
+        self.channel_budget = channel_budget
+        self.costs = costs
+        self.sweep_interval = sweep_interval
+        self.users = {}
+        self.channels = {}
+        # users and channels that were already told they are over budget
+        self.warned = set()
+        self.swept_at = time.monotonic()
+        self.admitted = 0
+        self.throttled = {"user": 0, "channel": 0, "message": 0}
+
+    def bucket(self, buckets, key, budget):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(*budget)
+        return bucket
+
+    # Returns None if the message may run, otherwise who is over budget, how long
+    # until it may run and whether they should be told about it. A message costs
+    # as much as all of the commands in it together. One that costs more than a
+    # bucket can ever hold is refused for good, "message" with no delay.
+    def admit(self, user_id, channel_id, cost_classes):
+        if not cost_classes:
+            return None
+        self.sweep()
+        cost = sum(self.costs[cost_class] for cost_class in cost_classes)
+        if cost > min(self.user_budget[1], self.channel_budget[1]):
+            self.throttled["message"] += 1
+            return "message", None, True
+        user = self.bucket(self.users, user_id, self.user_budget)
+        channel = self.bucket(self.channels, channel_id, self.channel_budget)
+        for name, key, bucket in (("user", user_id, user), ("channel", channel_id, channel)):
+            delay = bucket.delay(cost)
+            if delay > 0:
+                self.throttled[name] += 1
+                warn = (name, key) not in self.warned
+                self.warned.add((name, key))
+                return name, delay, warn
+        user.take(cost)
+        channel.take(cost)
+        self.warned.discard(("user", user_id))
+        self.warned.discard(("channel", channel_id))
+        self.admitted += 1
+        return None
+
+    # buckets that have filled up again are the same as new ones
+    def sweep(self):
+        now = time.monotonic()
+        if now - self.swept_at < self.sweep_interval:
+            return
+        self.swept_at = now
+        for buckets in (self.users, self.channels):
+            for key, bucket in list(buckets.items()):
+                bucket.refill()
+                if bucket.tokens >= bucket.burst:
+                    del buckets[key]
+        self.warned.clear()
+
+    def stats(self, limit=5):
+        lines = [f"Costs: {', '.join(f'{name} {cost}' for name, cost in self.costs.items())}",
+                 f"Admitted: {self.admitted}, throttled: {self.throttled['user']} by user budget, {self.throttled['channel']} by channel budget, "
+                 f"{self.throttled['message']} costing more than a whole budget"]
+        for name, buckets, (rate, burst) in (("user", self.users, self.user_budget), ("channel", self.channels, self.channel_budget)):
+            for bucket in buckets.values():
+                bucket.refill()
+            lowest = sorted(buckets.items(), key=lambda item: item[1].tokens)[:limit]
+            lines.append(f"{name.capitalize()} buckets: {len(buckets)} tracked, {rate:g}/s, burst {burst}; lowest: "
+                         f"{', '.join(f'{key}: {bucket.tokens:.1f}' for key, bucket in lowest) or 'none'}")
+        return '\n'.join(lines)
+
+
+# whether a frame posts a new message rather than changing one
+def is_send(frame):
+    return all(frame.get(action) is None for action in ("edit", "delete", "react"))
+
+
+class ChannelBudget:
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.held = []
+        self.timer = None
+
+
+# Keeps each channel within Discord's per-channel message rate. Text-only
+# replies sent while a channel is over its budget are held and merged into as
+# few messages as possible; images are never held, they only use up budget.
+# Edits, deletions and reactions use the same budget, but are never merged.
+class SendScheduler:
+    def __init__(self, registry, rate, burst, max_length=2000):
+        self.registry = registry
+        self.rate = rate
+        self.burst = burst
+        self.max_length = max_length
+        # budgets disappear together with the channel once it is no longer cached
+        self.budgets = weakref.WeakKeyDictionary()
+        self.sent = 0
+        self.held = 0
+        self.merged = 0
+
+    def budget(self, channel):
+        budget = self.budgets.get(channel)
+        if budget is None:
+            budget = self.budgets[channel] = ChannelBudget(self.rate, self.burst)
+        return budget
+
+    async def send(self, channel, frame):
+        budget = self.budget(channel)
+        if budget.held and not is_send(frame):
+            # kept behind what is held already, an earlier change to the same message may be waiting
+            return self.hold(channel, budget, frame)
+        if frame.get("file") is not None or frame.get("embed") is not None or frame.get("files") or frame.get("embeds"):
+            budget.bucket.force()
+        elif budget.held or not budget.bucket.take():
+            return self.hold(channel, budget, frame)
+        self.sent += 1
+        await self.registry.deliver(channel, frame)
+
+    def hold(self, channel, budget, frame):
+        self.held += 1
+        last = budget.held[-1] if budget.held else None
+        if (last is not None and is_send(last) and is_send(frame) and isinstance(last["message"], str) and isinstance(frame["message"], str)
+                and len(last["message"]) + 1 + len(frame["message"]) <= self.max_length):
+            last["message"] += "\n" + frame["message"]
+            # the merged reply answers for both messages
+            self.registry.alias(frame["nonce"], last["nonce"])
+            self.merged += 1
+        else:
+            budget.held.append(dict(frame))
+        if budget.timer is None:
+            budget.timer = asyncio.get_event_loop().call_later(budget.bucket.delay(), lambda: asyncio.ensure_future(self.flush(channel)))
+
+    async def flush(self, channel):
+        budget = self.budget(channel)
+        budget.timer = None
+        while budget.held and budget.bucket.take():
+            self.sent += 1
+            await self.registry.deliver(channel, budget.held.pop(0))
+        if budget.held and budget.timer is None:
+            budget.timer = asyncio.get_event_loop().call_later(budget.bucket.delay(), lambda: asyncio.ensure_future(self.flush(channel)))
+
+    def stats(self):
+        waiting = [(channel, budget) for channel, budget in self.budgets.items() if budget.held]
+        return (f"Send budget: {self.rate:g}/s, burst {self.burst}, {len(self.budgets)} channels tracked\n"
+                f"Sent: {self.sent}, held: {self.held}, merged into another reply: {self.merged}\n"
+                f"Held now: {sum(len(budget.held) for _, budget in waiting)} messages in {len(waiting)} channels")
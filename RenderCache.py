@@ -0,0 +1,183 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# Rasterised SVGs by a hash of the SVG and the render options. Recently used
+# images are kept in memory, up to `memory_limit` bytes, in front of a
+# directory of up to `disk_limit` bytes that survives restarts. Both tiers
+# evict the least recently used image first, on disk by modification time,
+# which a hit refreshes.
+#
+# Every render worker process has a cache of its own in front of the same
+# directory. Only the main process (the one with `evicts` set) evicts from
+# it: the workers' writes reach it with their counts, and once the directory
+# may be over the limit it is scanned and trimmed to `low_water` of it.
+class RenderCache:
+    COUNTERS = ("memory_hits", "disk_hits", "misses", "memory_evictions", "disk_evictions", "rendered_bytes", "served_bytes", "written_bytes")
+
+    def __init__(self, memory_limit, directory, disk_limit, low_water=0.9):
+        self.memory_limit = memory_limit
+        self.directory = directory
+        self.disk_limit = disk_limit
+        self.low_water = low_water
+        self.memory = OrderedDict()
+        self.memory_size = 0
+        self.evicts = True
+        self.evicting = False
+        self.directory_ready = False
+        # size and number of the images on disk at the last scan, None before the first one
+        self.disk_size = None
+        self.disk_count = 0
+        # bytes written to disk by this process and the render workers, and how many of them before the last scan started
+        self.written = 0
+        self.written_at_scan = 0
+        # renders run in the thread pool, several at a time
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(RenderCache.COUNTERS, 0)
+        # counted in render worker processes and handed over with the finished image
+        self.merged = dict.fromkeys(RenderCache.COUNTERS, 0)
+
+    @staticmethod
+    def key(svg, options):
+        digest = hashlib.blake2b(svg, digest_size=20)
+        digest.update(repr(sorted(options.items())).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return f"{self.directory}/{key}.png"
+
+    def get(self, key):
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                self.counts["memory_hits"] += 1
+                self.counts["served_bytes"] += len(data)
+                return data
+        if self.disk_limit <= 0:
+            return None
+        # another process may have written it, or evicted it
+        try:
+            with open(self.path(key), "rb") as file:data = file.read()
+        except OSError:
+            return None
+        try:os.utime(self.path(key))
+        except OSError:pass
+        with self.lock:
+            self.remember(key, data)
+            self.counts["disk_hits"] += 1
+            self.counts["served_bytes"] += len(data)
+        return data
+
+    def put(self, key, data):
+        with self.lock:
+            self.counts["misses"] += 1
+            self.counts["rendered_bytes"] += len(data)
+            self.remember(key, data)
+        if self.disk_limit <= 0:
+            return
+        # written under a temporary name so other workers never read half an image
+        temporary = f"{self.path(key)}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            if not self.directory_ready:
+                os.makedirs(self.directory, exist_ok=True)
+                self.directory_ready = True
+            with open(temporary, "wb") as file:file.write(data)
+            os.replace(temporary, self.path(key))
+        except OSError as e:
+            print(f"Couldn't write {key} to the render cache: {str(e)}")
+            return
+        with self.lock:
+            self.counts["written_bytes"] += len(data)
+            self.written += len(data)
+        self.check_disk()
+
+    def disk_estimate(self):
+        return self.disk_size + self.written - self.written_at_scan
+
+    # Starts a scan of the directory if it hasn't been scanned yet or may be over the limit
+    def check_disk(self):
+        if not self.evicts or self.disk_limit <= 0:
+            return
+        with self.lock:
+            if self.evicting or (self.disk_size is not None and self.disk_estimate() <= self.disk_limit):
+                return
+            self.evicting = True
+        threading.Thread(target=self.evict_disk, name="render-cache-eviction", daemon=True).start()
+
+    def evict_disk(self):
+        with self.lock:
+            written = self.written
+        size = count = evicted = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".png"):
+                    try:stat = entry.stat()
+                    except OSError:continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            size, count = sum(entry[1] for entry in entries), len(entries)
+            if size > self.disk_limit:
+                for _, entry_size, path in sorted(entries):
+                    if size <= self.disk_limit * self.low_water:
+                        break
+                    try:os.remove(path)
+                    except OSError:continue
+                    size -= entry_size
+                    count -= 1
+                    evicted += 1
+        except OSError as e:
+            print(f"Couldn't scan the render cache: {str(e)}")
+        finally:
+            with self.lock:
+                self.disk_size, self.disk_count = size, count
+                self.written_at_scan = written
+                self.counts["disk_evictions"] += evicted
+                self.evicting = False
+
+    # takes the lock first
+    def remember(self, key, data):
+        if key in self.memory or len(data) > self.memory_limit:
+            return
+        self.memory[key] = data
+        self.memory_size += len(data)
+        while self.memory_size > self.memory_limit:
+            _, old = self.memory.popitem(last=False)
+            self.memory_size -= len(old)
+            self.counts["memory_evictions"] += 1
+
+    def svg2png(self, render, svg, **options):
+        key = RenderCache.key(svg, options)
+        data = self.get(key)
+        if data is None:
+            data = render(svg, **options)
+            self.put(key, data)
+        return data
+
+    # Counts since the last call, for a render worker to send back
+    def take_counts(self):
+        with self.lock:
+            counts, self.counts = self.counts, dict.fromkeys(RenderCache.COUNTERS, 0)
+        return counts
+
+    def merge(self, counts):
+        for name, count in counts.items():
+            self.merged[name] += count
+        with self.lock:
+            self.written += counts["written_bytes"]
+        self.check_disk()
+
+    def stats(self):
+        counts = {name: self.counts[name] + self.merged[name] for name in RenderCache.COUNTERS}
+        lookups = counts["memory_hits"] + counts["disk_hits"] + counts["misses"]
+        hit_rate = (counts["memory_hits"] + counts["disk_hits"]) / lookups * 100 if lookups else 0
+        disk = (f"{self.disk_count} images at the last scan, about {self.disk_estimate() / 1024 / 1024:.1f}/{self.disk_limit / 1024 / 1024:g} MiB"
+                if self.disk_size is not None else "not scanned yet")
+        return (f"Hit rate: {hit_rate:.1f}% of {lookups} renders ({counts['memory_hits']} from memory, {counts['disk_hits']} from disk)\n"
+                f"Memory: {len(self.memory)} images, {self.memory_size / 1024 / 1024:.1f}/{self.memory_limit / 1024 / 1024:g} MiB, {counts['memory_evictions']} evicted\n"
+                f"Disk: {disk}, {counts['disk_evictions']} evicted\n"
+                f"Rendered: {counts['rendered_bytes'] / 1024 / 1024:.1f} MiB, served from the cache: {counts['served_bytes'] / 1024 / 1024:.1f} MiB"
+                + ("\nHits and evictions include the render workers, the memory tier is this process's own" if any(self.merged.values()) else ""))
@@ -0,0 +1,212 @@
+import os
+import time
+import pickle
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory, resource_tracker
+from Metrics import LatencyHistogram
+
+
+# Runs in every worker before its first render, so the first real render
+# doesn't pay for importing the modules and loading cairo and ImageMagick
+def warm_up():
+    import cairosvg
+    import modules
+    from wand.image import Image
+    # the main process keeps the disk tier of the render cache in check
+    modules.render_cache.evicts = False
+    cairosvg.svg2png(b'<svg xmlns="http://www.w3.org/2000/svg" width="1" height="1"/>')
+    with Image(width=1, height=1) as im:
+        im.format = 'png'
+        im.make_blob()
+
+# The image, its file name and how long the render itself took, without any
+# time spent waiting for a thread or worker
+def timed_render(snapshot, strike, scale, effort):
+    start = time.perf_counter()
+    data, filename = snapshot.render(strike, scale, effort)
+    return data, filename, time.perf_counter() - start
+
+# The block a worker returns an image in is the parent's to unlink. Before
+# 3.13 every process that opens a block registers it with the resource
+# tracker, so the worker takes its registration back, or the tracker would
+# unlink the block a second time and warn about a leak.
+def create_block(size):
+    try:
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(create=True, size=size)
+        resource_tracker.unregister(block._name, "shared_memory")
+        return block
+
+# The image goes back through shared memory instead of being pickled through
+# the pool's pipe. The caller unlinks the block once it has read it. The
+# worker's render cache and image encoder counts come along so the bot's
+# stats include them. `format` is the one the main process settled on for the
+# module type, if it has, so the worker doesn't run the format trials again.
+def render_to_shared_memory(payload, strike, scale, effort, format):
+    from modules import render_cache, image_encoder
+    snapshot = pickle.loads(payload)
+    if format is not None:
+        image_encoder.chosen[type(snapshot).__name__] = format
+    data, filename, seconds = timed_render(snapshot, strike, scale, effort)
+    block = create_block(max(len(data), 1))
+    block.buf[:len(data)] = data
+    block.close()
+    return block.name, len(data), filename, seconds, render_cache.take_counts(), image_encoder.take_counts()
+
+def read_shared_memory(name, size):
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+        block.unlink()
+
+
+# Renders module snapshots in a thread pool of its own, so renders don't
+# queue up behind other blocking work in the event loop's default pool
+class ThreadRenderer:
+    def __init__(self, workers):
+        # renders that can run at once, the scheduler queues the rest
+        self.concurrency = workers
+        self.threads = ThreadPoolExecutor(workers, thread_name_prefix="render")
+        self.renders = 0
+        self.latency = LatencyHistogram()
+
+    def start(self):
+        pass
+
+    async def render(self, snapshot, strike, scale=1, effort=1):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        result = await loop.run_in_executor(self.threads, timed_render, snapshot, strike, scale, effort)
+        self.renders += 1
+        self.latency.record(loop.time() - start)
+        return result
+
+    # Other blocking work that comes with renders, kept off the event loop
+    async def offload(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.threads, function, *args)
+
+    def stats(self):
+        return f"Backend: thread, {self.concurrency} threads\nRenders: {self.renders}, {self.latency}"
+
+
+# Renders module snapshots in a pool of worker processes, so cairosvg and Wand
+# aren't held back by the GIL. Workers are spawned and warmed up by start().
+# To keep their memory in check, once the pool has done `max_renders` renders
+# per worker a fresh pool takes over and the old one finishes what it has
+# (max_tasks_per_child can deadlock the pool when a worker exits on 3.11).
+class ProcessRenderer(ThreadRenderer):
+    def __init__(self, workers, max_renders):
+        super().__init__(workers)
+        self.workers = workers
+        self.max_renders = max_renders
+        self.pool = None
+        self.pool_renders = 0
+        self.recycled = 0
+        self.restarts = 0
+        self.fallbacks = 0
+        self.bytes = 0
+        # module types whose snapshots can't be sent to a worker
+        self.unpicklable = set()
+
+    def start(self):
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=warm_up)
+        self.pool_renders = 0
+        # workers are only spawned for submitted work, so give each of them something to do
+        for _ in range(self.workers):
+            self.pool.submit(os.getpid)
+
+    def recycle(self):
+        self.pool.shutdown(wait=False)
+        self.recycled += 1
+        self.start()
+
+    def restart(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.restarts += 1
+        self.start()
+
+    # Runs a render in `pool`. The worker's block is read and unlinked by the
+    # pool's own thread as soon as the render is done, so it is unlinked even
+    # if the render isn't waited for any more.
+    def submit(self, pool, *args):
+        loop = asyncio.get_event_loop()
+        result = loop.create_future()
+        def finish(outcome):
+            if not result.done():
+                if isinstance(outcome, BaseException):
+                    result.set_exception(outcome)
+                else:
+                    result.set_result(outcome)
+        def collect(future):
+            if future.cancelled():
+                outcome = BrokenProcessPool("render cancelled by a pool restart")
+            elif future.exception() is not None:
+                outcome = future.exception()
+            else:
+                name, size, *rest = future.result()
+                try:
+                    outcome = (read_shared_memory(name, size), size, *rest)
+                except Exception as e:
+                    outcome = e
+            # the event loop may already be gone when the bot shuts down mid-render
+            try:loop.call_soon_threadsafe(finish, outcome)
+            except RuntimeError:pass
+        pool.submit(render_to_shared_memory, *args).add_done_callback(collect)
+        return result
+
+    async def render(self, snapshot, strike, scale=1, effort=1):
+        if self.pool is None:
+            self.start()
+        try:
+            payload = pickle.dumps(snapshot)
+        except Exception:
+            self.unpicklable.add(type(snapshot).__name__)
+            self.fallbacks += 1
+            return await super().render(snapshot, strike, scale, effort)
+
+        from modules import render_cache, image_encoder
+        format = image_encoder.chosen.get(type(snapshot).__name__)
+        if self.pool_renders >= self.workers * self.max_renders:
+            self.recycle()
+        self.pool_renders += 1
+        pool = self.pool
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        try:
+            data, size, filename, seconds, cache_counts, encoder_counts = await self.submit(pool, payload, strike, scale, effort, format)
+        except BrokenProcessPool:
+            # a worker died in the middle of a render, the whole pool has to be replaced
+            if pool is self.pool:
+                print("Render worker died, restarting the render pool")
+                self.restart()
+            try:
+                data, size, filename, seconds, cache_counts, encoder_counts = await self.submit(self.pool, payload, strike, scale, effort, format)
+            except BrokenProcessPool:
+                print("Render pool broke again, rendering in a thread instead")
+                self.fallbacks += 1
+                return await super().render(snapshot, strike, scale, effort)
+        render_cache.merge(cache_counts)
+        image_encoder.merge(encoder_counts)
+        self.renders += 1
+        self.bytes += size
+        self.latency.record(loop.time() - start)
+        return data, filename, seconds
+
+    def stats(self):
+        return (f"Backend: process, {self.workers} workers, recycled after {self.max_renders} renders each\n"
+                f"Renders: {self.renders}, {self.latency}\n"
+                f"Returned through shared memory: {self.bytes / 1024 / 1024:.1f} MiB, pools recycled: {self.recycled}, restarted after a crash: {self.restarts}\n"
+                f"Rendered in a thread instead: {self.fallbacks}"
+                + (f" ({', '.join(sorted(self.unpicklable))})" if self.unpicklable else ""))
+
+
+def create_renderer(backend, workers, max_renders):
+    if backend == "process":
+        return ProcessRenderer(workers, max_renders)
+    return ThreadRenderer(workers)
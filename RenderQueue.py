@@ -0,0 +1,149 @@
+import heapq
+import asyncio
+import itertools
+from Metrics import LatencyHistogram
+
+
+# Picks the quality renders are made at from how far behind the scheduler
+# is. Each level is a (scale, encoder effort) pair, best first. Under
+# pressure, more than `depth[0]` renders queued or an average queue wait
+# over `wait[0]` seconds, the level steps down, at most once a second. It
+# only steps back up once the queue has stayed under `depth[1]` and
+# `wait[1]` for `hold` seconds, one step per `hold` seconds, so it doesn't
+# flap. Classes in `full_quality` are always rendered at the best level.
+class QualityController:
+    def __init__(self, levels, depth, wait, hold, full_quality=("critical",), alpha=0.3):
+        self.levels = levels
+        self.high_depth, self.low_depth = depth
+        self.high_wait, self.low_wait = wait
+        self.hold = hold
+        self.full_quality = full_quality
+        self.alpha = alpha
+        self.level = 0
+        self.changed_at = 0.0
+        self.calm_since = None
+        # moving average of the queue wait, in seconds
+        self.wait = 0.0
+        self.steps_down = 0
+        self.steps_up = 0
+        self.renders = [0] * len(levels)
+
+    def observe(self, depth, wait, now):
+        self.wait += self.alpha * (wait - self.wait)
+        if depth > self.high_depth or self.wait > self.high_wait:
+            self.calm_since = None
+            if self.level < len(self.levels) - 1 and now - self.changed_at >= 1:
+                self.level += 1
+                self.changed_at = now
+                self.steps_down += 1
+        elif depth <= self.low_depth and self.wait <= self.low_wait:
+            if self.calm_since is None:
+                self.calm_since = now
+            steps = min(int((now - max(self.calm_since, self.changed_at)) // self.hold), self.level)
+            if steps > 0:
+                self.level -= steps
+                self.changed_at = now
+                self.steps_up += steps
+        else:
+            self.calm_since = None
+
+    def settings(self, priority):
+        level = 0 if priority in self.full_quality else self.level
+        self.renders[level] += 1
+        return self.levels[level]
+
+    def stats(self):
+        scale, effort = self.levels[self.level]
+        return (f"Quality: level {self.level + 1}/{len(self.levels)} (scale {scale:g}, encoder effort {effort:g}), average wait {self.wait * 1000:.1f}ms, "
+                f"stepped down {self.steps_down} times, up {self.steps_up} times\n"
+                f"  renders by level: {', '.join(f'{scale:g}x: {count}' for (scale, _), count in zip(self.levels, self.renders))}")
+
+
+# Renders waiting for a free slot of the render backend, by priority class.
+# Every render gets a deadline of its class's budget from when it was queued
+# and the free slots go to the earliest deadline first. A strike or solve
+# with a short budget overtakes a backlog of views, while a view that has
+# waited out its budget still comes before newer work, so nothing starves.
+class RenderScheduler:
+    def __init__(self, renderer, deadlines, quality, default_class="command"):
+        self.renderer = renderer
+        # class -> seconds a render of that class may take from being queued to being done
+        self.deadlines = deadlines
+        self.quality = quality
+        self.default_class = default_class
+        self.concurrency = renderer.concurrency
+        self.running = 0
+        # (deadline, sequence number, class, future that is resolved once the render has a slot)
+        self.queue = []
+        self.sequence = itertools.count()
+        self.max_depth = 0
+        self.wait_time = {name: LatencyHistogram() for name in deadlines}
+        self.rendered = dict.fromkeys(deadlines, 0)
+        self.missed = dict.fromkeys(deadlines, 0)
+
+    def start(self):
+        self.renderer.start()
+
+    # `quality` is the class whose quality settings the render gets, when that
+    # isn't the class it is scheduled as. Returns the image, its file name, the
+    # seconds the render took at the best level (None at other levels) and the
+    # (scale, effort) it was made at.
+    async def render(self, snapshot, strike, priority=None, quality=None):
+        if priority not in self.deadlines:
+            priority = self.default_class
+        loop = asyncio.get_event_loop()
+        queued_at = loop.time()
+        deadline = queued_at + self.deadlines[priority]
+        if self.running < self.concurrency and not self.queue:
+            self.running += 1
+        else:
+            slot = loop.create_future()
+            heapq.heappush(self.queue, (deadline, next(self.sequence), priority, slot))
+            self.max_depth = max(self.max_depth, len(self.queue))
+            try:
+                await slot
+            except asyncio.CancelledError:
+                # the slot may have been handed over just before the cancellation
+                if slot.done() and not slot.cancelled():
+                    self.release()
+                raise
+        waited = loop.time() - queued_at
+        self.wait_time[priority].record(waited)
+        self.quality.observe(len(self.queue), waited, loop.time())
+        scale, effort = self.quality.settings(quality or priority)
+        try:
+            data, filename, seconds = await self.renderer.render(snapshot, strike, scale, effort)
+            # what a render costs is only known from full quality ones
+            return data, filename, seconds if (scale, effort) == self.quality.levels[0] else None, (scale, effort)
+        finally:
+            self.rendered[priority] += 1
+            if loop.time() > deadline:
+                self.missed[priority] += 1
+            self.release()
+
+    async def offload(self, function, *args):
+        return await self.renderer.offload(function, *args)
+
+    # Whether a render would start right away
+    def idle(self):
+        return not self.queue and self.running < self.concurrency
+
+    # Hands the slot of a finished render to the earliest deadline waiting
+    def release(self):
+        self.running -= 1
+        while self.queue and self.running < self.concurrency:
+            _, _, _, slot = heapq.heappop(self.queue)
+            if not slot.done():
+                self.running += 1
+                slot.set_result(None)
+
+    def depth(self, priority):
+        return sum(1 for _, _, name, slot in self.queue if name == priority and not slot.done())
+
+    def stats(self):
+        return '\n'.join([self.renderer.stats(),
+                          f"Scheduler: running {self.running}/{self.concurrency}, queued {len(self.queue)} (max {self.max_depth})",
+                          *(f"  {name} (deadline {deadline:g}s): queued {self.depth(name)}, rendered {self.rendered[name]}, "
+                            f"missed the deadline {self.missed[name]}, wait: {self.wait_time[name]}"
+                            for name, deadline in sorted(self.deadlines.items(), key=lambda item: item[1])),
+                          self.quality.stats()])
@@ -0,0 +1,137 @@
+import os
+import re
+import gzip
+import time
+import shutil
+import asyncio
+import threading
+
+
+def highest_number(directory, pattern):
+    # only used the first time a counter is created, to continue after existing files
+    numbers = [int(match.group(1)) for match in map(re.compile(pattern).fullmatch, os.listdir(directory)) if match]
+    return max(numbers, default=0)
+
+
+# Hands out increasing numbers for file names without looking at the directory.
+# The file at `path` holds the first number not handed out yet; numbers are
+# reserved `reserve` at a time, so it is only written once per block and a
+# restart skips the rest of the block instead of reusing numbers.
+class FileCounter:
+    def __init__(self, path, initial=1, reserve=1000):
+        self.path = path
+        self.reserve = reserve
+        self.lock = threading.Lock()
+        try:
+            with open(path) as file:self.next = int(file.read())
+        except (OSError, ValueError):
+            self.next = initial() if callable(initial) else initial
+        self.limit = self.next
+
+    def allocate(self):
+        with self.lock:
+            if self.next >= self.limit:
+                self.limit = self.next + self.reserve
+                temporary = f"{self.path}.tmp"
+                with open(temporary, "w") as file:file.write(str(self.limit))
+                os.replace(temporary, self.path)
+            number = self.next
+            self.next += 1
+            return number
+
+
+# What to keep in one directory. Files older than `archive_after` seconds are
+# gzipped, files older than `max_age` are deleted, and after that the oldest
+# files are deleted until the rest fit into `max_bytes`. Hidden files, such as
+# counters, are left alone.
+class RetentionPolicy:
+    def __init__(self, directory, max_age, max_bytes, archive_after=None):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.archive_after = archive_after
+        self.files = 0
+        self.bytes = 0
+        self.archived = 0
+        self.deleted = 0
+
+    def scan(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(files)
+
+    def archive(self, path):
+        with open(path, "rb") as source, gzip.open(f"{path}.gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        # the archive keeps the age of the file it replaces
+        stat = os.stat(path)
+        os.utime(f"{path}.gz", (stat.st_atime, stat.st_mtime))
+        os.remove(path)
+        self.archived += 1
+
+    def delete(self, path):
+        try:
+            os.remove(path)
+            self.deleted += 1
+        except FileNotFoundError:
+            pass
+
+    def apply(self, now):
+        if not os.path.isdir(self.directory):
+            return
+        if self.archive_after is not None:
+            for mtime, _, path in self.scan():
+                if now - mtime > self.archive_after and not path.endswith(".gz"):
+                    self.archive(path)
+        files = self.scan()
+        kept = []
+        for mtime, size, path in files:
+            if now - mtime > self.max_age:
+                self.delete(path)
+            else:
+                kept.append((size, path))
+        total = sum(size for size, _ in kept)
+        while kept and total > self.max_bytes:
+            size, path = kept.pop(0)
+            self.delete(path)
+            total -= size
+        self.files = len(kept)
+        self.bytes = total
+
+    def stats(self):
+        return (f"{self.directory}: {self.files} files, {self.bytes / 1024 / 1024:.1f}/{self.max_bytes / 1024 / 1024:g} MiB, "
+                f"kept {self.max_age / 3600:g}h" + (f", gzipped after {self.archive_after / 3600:g}h" if self.archive_after is not None else "")
+                + f"; {self.archived} archived, {self.deleted} deleted")
+
+
+# Applies the policies every `interval` seconds in the background
+class Retention:
+    def __init__(self, policies, interval):
+        self.policies = policies
+        self.interval = interval
+        self.swept_at = None
+        self.sweep_time = 0.0
+
+    def sweep(self):
+        start = time.monotonic()
+        now = time.time()
+        for policy in self.policies:
+            try:
+                policy.apply(now)
+            except OSError as e:
+                print(f"Retention sweep of {policy.directory} failed: {str(e)}")
+        self.swept_at = time.monotonic()
+        self.sweep_time = self.swept_at - start
+
+    async def run(self):
+        while True:
+            await asyncio.get_event_loop().run_in_executor(None, self.sweep)
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        last = f"{time.monotonic() - self.swept_at:.0f}s ago, took {self.sweep_time * 1000:.1f}ms" if self.swept_at is not None else "never"
+        return f"Every {self.interval:g}s, last sweep {last}\n" + '\n'.join(policy.stats() for policy in self.policies)
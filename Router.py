@@ -0,0 +1,81 @@
+import time
+from Metrics import LatencyHistogram
+
+
+# A command after alias resolution. All aliases of a command share one route.
+class Route:
+    def __init__(self, name, command, handler, scope):
+        self.name = name
+        self.command = command
+        self.handler = handler
+        # "generic" handlers take the channel, "bomb" and "module" ones the bomb or module
+        self.scope = scope
+        self.latency = LatencyHistogram()
+
+
+def compile_commands(commands, scope, prefix=""):
+    routes = {}
+    canonical = {}
+    # the first name a handler appears under is its canonical name, the rest are aliases
+    for alias, handler in commands.items():
+        if handler not in canonical:
+            canonical[handler] = Route(prefix + alias, alias, handler, scope)
+        routes[alias] = canonical[handler]
+    return routes
+
+
+# Maps the words of a message to the handler that runs it, built once at startup
+# from the generic commands, Bomb.COMMANDS and every module's COMMANDS.
+class Router:
+    def __init__(self, generic, bomb, module_classes):
+        self.generic = compile_commands(generic, "generic")
+        self.bomb = compile_commands(bomb, "bomb")
+        self.modules = {module_class: compile_commands(module_class.COMMANDS, "module", f"{module_class.__name__}.")
+                        for module_class in module_classes}
+
+    def routes(self):
+        seen = {}
+        for routes in (self.generic, self.bomb, *self.modules.values()):
+            for route in routes.values():
+                seen[id(route)] = route
+        return seen.values()
+
+    # Returns (route, target, parts) or None if the message has to go through
+    # the bomb's and module's own error handling
+    def resolve(self, command, parts, bomb):
+        route = self.generic.get(command)
+        if route is not None:
+            return route, None, parts
+        if bomb is None:
+            return None
+        route = self.bomb.get(command)
+        if route is not None:
+            return route, bomb, parts
+        if command.isdigit() and parts and 1 <= int(command) <= len(bomb.modules):
+            module = bomb.modules[int(command) - 1]
+            route = self.modules.get(type(module), {}).get(parts[0].lower())
+            if route is not None:
+                return route, module, parts[1:]
+        return None
+
+    async def run(self, resolved, channel, author):
+        route, target, parts = resolved
+        start = time.monotonic()
+        try:
+            if route.scope == "generic":
+                await route.handler(channel, author, parts)
+            else:
+                if route.scope == "module":
+                    target.log(f"COMMAND: {route.command} {' '.join(parts)}")
+                await route.handler(target, author, parts)
+        finally:
+            route.latency.record(time.monotonic() - start)
+
+    def stats(self, name=None, limit=12):
+        routes = [route for route in self.routes() if route.latency.count]
+        if name is not None:
+            routes = [route for route in routes if name in route.name.lower()]
+        routes.sort(key=lambda route: route.latency.total, reverse=True)
+        if not routes:
+            return "No commands have run yet." if name is None else f"No command matching {name} has run yet."
+        return '\n'.join(f"{route.name}: {route.latency}" for route in routes[:limit])
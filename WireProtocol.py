@@ -0,0 +1,208 @@
+import struct
+
+# Compact binary framing for the simulator <-> frontend websocket, used
+# instead of JSON when the frontend offers it in its hello message.
+#
+# Every binary websocket message is one frame: a header followed by
+# `count` records of the frame's type. All integers are big-endian,
+# strings are UTF-8 prefixed with their length as an unsigned short and
+# binary blobs are prefixed with their length as an unsigned int.
+#
+# MESSAGE records (frontend -> simulator):
+#     channel id, guild id (0 in DMs), author id, message id as unsigned long longs,
+#     then the author's username and discriminator and the message content as strings
+# REPLY records (simulator -> frontend):
+#     channel id, nonce (0 when no message handle is wanted) and target message id
+#     (0 for SEND) as unsigned long longs, the action, embed count and file count as
+#     unsigned chars, the message text as a string, then for each embed its title, description and
+#     image as strings, and for each file a kind byte, the filename as a string and
+#     either the path as a string (FILE_PATH) or the contents as a blob (FILE_INLINE).
+#     A record with several embeds or files is a combined reply, posted as one message.
+#     For REACT the message text is the emoji to react to the target message with.
+
+NAME = "ktsim/1"
+VERSION = 1
+
+HEADER = struct.Struct("!BBH")
+MESSAGE = 1
+REPLY = 2
+
+MESSAGE_IDS = struct.Struct("!QQQQ")
+REPLY_HEAD = struct.Struct("!QQQBBB")
+STRING = struct.Struct("!H")
+BLOB = struct.Struct("!I")
+KIND = struct.Struct("!B")
+
+FILE_PATH = 1
+FILE_INLINE = 2
+
+SEND = 0
+EDIT = 1
+DELETE = 2
+REACT = 3
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def unpack(self, fmt):
+        try:
+            values = fmt.unpack_from(self.data, self.offset)
+        except struct.error:
+            raise ProtocolError("truncated frame")
+        self.offset += fmt.size
+        return values
+
+    def blob(self, fmt=BLOB):
+        length, = self.unpack(fmt)
+        if self.offset + length > len(self.data):
+            raise ProtocolError("truncated frame")
+        value = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return value
+
+    def string(self):
+        return str(self.blob(STRING), "utf-8")
+
+
+def pack_string(parts, value):
+    encoded = (value or "").encode("utf-8")
+    if len(encoded) > 0xFFFF:
+        raise ProtocolError("string too long")
+    parts.append(STRING.pack(len(encoded)))
+    parts.append(encoded)
+
+
+# The embeds and files of a reply, a combined reply carries all of its images in one record
+def reply_parts(frame):
+    embeds = frame.get("embeds") or ([frame["embed"]] if frame.get("embed") is not None else [])
+    files = frame.get("files") or ([frame["file"]] if frame.get("file") is not None else [])
+    return embeds, files
+
+
+# Raises ProtocolError for a reply that couldn't be encoded, so it is refused
+# when it is sent instead of when a connection's writer gets to it
+def check_reply(frame):
+    embeds, files = reply_parts(frame)
+    if len(embeds) > 0xFF or len(files) > 0xFF:
+        raise ProtocolError("too many embeds or files in one reply")
+    strings = [frame["message"], *(embed.get(key) for embed in embeds for key in ("title", "description", "image")),
+               *(file.get(key) for file in files for key in ("filename", "path"))]
+    for value in strings:
+        if isinstance(value, str) and len(value.encode("utf-8")) > 0xFFFF:
+            raise ProtocolError(f"string too long: {value[:20]}...")
+
+
+def read_header(reader, expected_type):
+    version, frame_type, count = reader.unpack(HEADER)
+    if version != VERSION:
+        raise ProtocolError(f"unsupported version {version}")
+    if frame_type != expected_type:
+        raise ProtocolError(f"unexpected frame type {frame_type}")
+    return count
+
+
+# Returns the messages in the same shape the JSON protocol uses
+def decode_messages(data):
+    reader = Reader(data)
+    messages = []
+    for _ in range(read_header(reader, MESSAGE)):
+        channel_id, guild_id, author_id, message_id = reader.unpack(MESSAGE_IDS)
+        username = reader.string()
+        discriminator = reader.string()
+        content = reader.string()
+        channel = {"id": channel_id}
+        if guild_id:
+            channel["guild"] = guild_id
+        messages.append({
+            "author": {"username": username, "discriminator": discriminator, "id": author_id},
+            "channel": channel,
+            "message": {"id": message_id, "content": content},
+        })
+    return messages
+
+
+def encode_messages(messages):
+    parts = [HEADER.pack(VERSION, MESSAGE, len(messages))]
+    for message in messages:
+        author, channel, content = message["author"], message["channel"], message["message"]
+        parts.append(MESSAGE_IDS.pack(channel["id"], channel.get("guild") or 0, author["id"], content["id"]))
+        pack_string(parts, author["username"])
+        pack_string(parts, author["discriminator"])
+        pack_string(parts, content["content"])
+    return b"".join(parts)
+
+
+def encode_replies(frames):
+    parts = [HEADER.pack(VERSION, REPLY, len(frames))]
+    for frame in frames:
+        embeds, files = reply_parts(frame)
+        if frame.get("edit") is not None:
+            action, target = EDIT, frame["edit"]
+        elif frame.get("delete") is not None:
+            action, target = DELETE, frame["delete"]
+        elif frame.get("react") is not None:
+            action, target = REACT, frame["react"]
+        else:
+            action, target = SEND, 0
+        parts.append(REPLY_HEAD.pack(frame["id"], frame.get("nonce") or 0, target, action, len(embeds), len(files)))
+        pack_string(parts, frame["message"])
+        for embed in embeds:
+            pack_string(parts, embed.get("title"))
+            pack_string(parts, embed.get("description"))
+            pack_string(parts, embed.get("image"))
+        for file in files:
+            if "data" in file:
+                parts.append(KIND.pack(FILE_INLINE))
+                pack_string(parts, file["filename"])
+                parts.append(BLOB.pack(len(file["data"])))
+                parts.append(file["data"])
+            else:
+                parts.append(KIND.pack(FILE_PATH))
+                pack_string(parts, file["filename"])
+                pack_string(parts, file["path"])
+    return b"".join(parts)
+
+
+def decode_replies(data):
+    reader = Reader(data)
+    frames = []
+    for _ in range(read_header(reader, REPLY)):
+        channel_id, nonce, target, action, embed_count, file_count = reader.unpack(REPLY_HEAD)
+        frame = {"id": channel_id, "message": reader.string(), "file": None, "embed": None}
+        if nonce:
+            frame["nonce"] = nonce
+        if action == EDIT:
+            frame["edit"] = target
+        elif action == DELETE:
+            frame["delete"] = target
+        elif action == REACT:
+            frame["react"] = target
+        elif action != SEND:
+            raise ProtocolError(f"unknown action {action}")
+        embeds = [{"title": reader.string(), "description": reader.string(), "image": reader.string()} for _ in range(embed_count)]
+        files = []
+        for _ in range(file_count):
+            kind, = reader.unpack(KIND)
+            filename = reader.string()
+            if kind == FILE_INLINE:
+                files.append({"filename": filename, "data": bytes(reader.blob())})
+            elif kind == FILE_PATH:
+                files.append({"filename": filename, "path": reader.string()})
+            else:
+                raise ProtocolError(f"unknown file kind {kind}")
+        if len(embeds) > 1 or len(files) > 1:
+            frame["embeds"], frame["files"] = embeds, files
+        else:
+            if embeds:
+                frame["embed"] = embeds[0]
+            if files:
+                frame["file"] = files[0]
+        frames.append(frame)
+    return frames
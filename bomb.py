@@ -12,14 +12,28 @@ import modules
 import edgework
 import traceback
 import BombSettings
+from Admission import Admission
+from Prerender import Prerenderer
+from RenderPool import create_renderer
+from RenderQueue import RenderScheduler, QualityController
+from Retention import FileCounter, highest_number
 from config import *
 
+LogOut = f"{os.path.dirname(os.path.realpath(__file__))}/logs"
+if not os.path.isdir(LogOut): os.mkdir(LogOut)
+# log files are numbered across restarts, after the ones that are already there
+log_counter = FileCounter(f"{LogOut}/.next", lambda: highest_number(LogOut, r"ktanesim_bomb(\d+)\.log(\.gz)?") + 1)
+
 class Bomb:
     SERIAL_NUMBER_CHARACTERS = "ABCDEFGHIJKLMNEPQRSTUVWXZ0123456789"
     bombs = {}
     opc_session = None
     client = None
     shutdown_mode = False
+    admission = Admission(MAX_BOMBS_PER_GUILD, MAX_MODULES_PER_GUILD, RENDER_CAPACITY, MAX_QUEUED_BOMBS, DEFAULT_RENDER_COST)
+    renderer = RenderScheduler(create_renderer(RENDER_BACKEND, RENDER_WORKERS, RENDER_WORKER_MAX_RENDERS), RENDER_DEADLINES,
+                               QualityController(RENDER_QUALITY_LEVELS, RENDER_PRESSURE_DEPTH, RENDER_PRESSURE_WAIT, RENDER_QUALITY_HOLD))
+    prerenderer = Prerenderer(renderer, PRERENDER_BUDGET, PRERENDER_MODULES)
 
     def __init__(self, channel, modules):
         self.channel = channel
@@ -28,10 +42,6 @@ class Bomb:
         self.start_time = time.monotonic()
         self.serial = self._randomize_serial()
 
-        self.FileRoot = os.path.dirname(os.path.realpath(__file__))
-        self.LogOut = f"{self.FileRoot}/logs"
-        if not os.path.isdir(self.LogOut): os.mkdir(self.LogOut)
-
         self.edgework = []
         for _ in range(5):
             self.edgework.append(random.choice(edgework.WIDGETS)(self))
@@ -39,7 +49,9 @@ class Bomb:
         self.modules = []
         random.shuffle(modules)
         for index, module in enumerate(modules):
+            start_time = time.monotonic()
             self.modules.append(module(self, index + 1))
+            Bomb.admission.costs.record_generate(module, time.monotonic() - start_time)
 
     @property
     def strike_count(self):return self.strikes
@@ -68,6 +80,10 @@ class Bomb:
 
         Bomb.shutdown_mode = True
 
+        for queued_channel, _ in Bomb.admission.queue:
+            asyncio.ensure_future(queued_channel.send(f"The bot is going into shutdown mode, so the bomb waiting to be armed in this channel won't be."))
+        Bomb.admission.queue.clear()
+
         for bomb_channel in Bomb.bombs:
             asyncio.ensure_future(bomb_channel.send(f"The bot is going into shutdown mode. No new bombs can be started and the bot will go offline when all currently running bombs are solved or detonated."))
 
@@ -98,6 +114,9 @@ class Bomb:
         if channel in Bomb.bombs:
             return await channel.send(f"{author.mention} A bomb is already ticking in this channel! Solve that one first!")
 
+        if Bomb.admission.is_queued(channel):
+            return await channel.send(f"{author.mention} A bomb is already waiting to be armed in this channel!")
+
         if Bomb.shutdown_mode:
             return await channel.send(f"{author.mention} The bot is in shutdown mode. No new bombs can be started.")
 
@@ -210,11 +229,31 @@ class Bomb:
                 if len(chosen_modules) > 101:
                     return await channel.send(f"{author.mention} Nope.")
 
+        quota = Bomb.admission.check_quota(channel, chosen_modules, Bomb.bombs.values())
+        if quota is not None:
+            return await channel.send(f"{author.mention} {quota}")
+
+        if Bomb.admission.queue or not Bomb.admission.fits(chosen_modules, Bomb.bombs.values()):
+            position = Bomb.admission.enqueue(channel, chosen_modules)
+            if position is None:
+                return await channel.send(f"{author.mention} The bot is too busy to take any more bombs right now. Please try again later.")
+            return await channel.send(f"{author.mention} The bot is busy right now, so your bomb will be armed as soon as there is room for it. It is number {position} in line.")
+
+        await Bomb.arm(channel, chosen_modules)
+
+    @staticmethod
+    async def arm(channel, chosen_modules):
         bomb = Bomb(channel, chosen_modules)
         Bomb.bombs[channel] = bomb
         await channel.send(f"A bomb with {len(bomb.modules)} {'modules' if len(bomb.modules) != 1 else 'module'} has been armed!\nEdgework: `{bomb.get_edgework()}`")
         await Bomb.update_presence()
 
+    # Arms the waiting bombs that fit now that a bomb has ended or a module was solved
+    @staticmethod
+    async def start_queued():
+        for channel, chosen_modules in Bomb.admission.ready(Bomb.bombs.values()):
+            await Bomb.arm(channel, chosen_modules)
+
     async def bomb_end(self, boom=False):
         if Bomb.opc_session is None and config.USE_OPC:
             Bomb.opc_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=OPC_TIMEOUT))
@@ -223,7 +262,7 @@ class Bomb:
 
         discord_upload = True
         log = self.get_log()
-        index = len(os.listdir(self.LogOut)) + 1
+        index = log_counter.allocate()
         filename = f"ktanesim_bomb{index}.log"
         if DEBUG_MODE:
             logurl = f"Debug mode enabled - uploading log to discord instead of OPC"
@@ -250,7 +289,7 @@ class Bomb:
                 logurl = f"OPC log upload failed with exception, uploading to discord:"
 
         if discord_upload:
-            filepath = f"{self.LogOut}/{filename}"
+            filepath = f"{LogOut}/{filename}"
             with open(filepath, "w") as file:file.write(log)
             file_ = {"path":filepath, "filename":filename}
         else:
@@ -259,6 +298,8 @@ class Bomb:
         await asyncio.gather(send_first_message_coro)
         await self.channel.send(logurl if config.USE_OPC else "", file=file_)
         del Bomb.bombs[self.channel]
+        for module in self.modules:
+            Bomb.prerenderer.forget(module)
         if Bomb.shutdown_mode and not Bomb.bombs:
             owner_user = discord.utils.find(lambda u: u.id == BOT_OWNER, Bomb.client.users)
             owner_dm = owner_user.dm_channel
@@ -267,6 +308,7 @@ class Bomb:
             await owner_dm.send('Shutdown complete.')
             Bomb.client.loop.stop()
         else:
+            await Bomb.start_queued()
             await Bomb.update_presence()
 
     def get_log(self):
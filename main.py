@@ -5,6 +5,7 @@ except:
 
 import discord
 import FakeDiscord
+import DiscordModels
 import asyncio
 import logging
 import random
@@ -12,7 +13,10 @@ import leaderboard
 import modules
 import traceback
 import BombSettings
-from bomb import Bomb
+from bomb import Bomb, LogOut
+from Router import Router
+from Retention import Retention, RetentionPolicy
+from Dispatcher import Tag
 
 async def cmd_help(channel, author, parts):
     print(f"Help: {channel}")
@@ -39,6 +43,7 @@ async def cmd_help(channel, author, parts):
         f"`{PREFIX}rank`: Shows your leaderboard entry.\n"
         f"`{PREFIX}settings`: Shows information about bomb settings.\n"
         f"`{PREFIX}implement`: Shows information about implementing a module.\n"
+        f"Separate commands with `;` to send up to {MAX_PIPELINE_COMMANDS} at once and get one reply, for example `{PREFIX}3 cv; {PREFIX}7 cv; {PREFIX}9 cv`.\n"
         f"\n"
         f"Original KTaNE Simulator by NieDzejkob#2571, now maintained by Qkrisi#4982"
         )
@@ -55,48 +60,153 @@ async def cmd_implement(channel, author, parts):
 async def cmd_allbombs(channel, author, parts):
     await channel.send(str(len(Bomb.bombs)))
 
+RETENTION = Retention([RetentionPolicy(FakeDiscord.RenderOut, RENDERED_MAX_AGE, RENDERED_MAX_BYTES),
+                       RetentionPolicy(LogOut, LOG_MAX_AGE, LOG_MAX_BYTES, LOG_ARCHIVE_AGE)], RETENTION_INTERVAL)
+
+STATS = {
+    "dispatch": FakeDiscord.dispatcher.stats,
+    "connections": FakeDiscord.connections.stats,
+    "channels": FakeDiscord.ChannelCache.stats,
+    "sends": FakeDiscord.connections.scheduler.stats,
+    "buckets": FakeDiscord.limiter.stats,
+    "admission": lambda: Bomb.admission.stats(Bomb.bombs.values()),
+    "renders": lambda: Bomb.renderer.stats(),
+    "cache": lambda: modules.render_cache.stats(),
+    "images": lambda: modules.image_encoder.stats(),
+    "prerender": lambda: Bomb.prerenderer.stats(),
+    "files": RETENTION.stats,
+    "commands": lambda: ROUTER.stats(),
+}
+
+async def cmd_stats(channel, author, parts):
+    if author.id != BOT_OWNER:
+        return await channel.send(f"{author.mention} You don't have permission to use this command.")
+
+    if len(parts) == 2 and parts[0].lower() == "commands":
+        return await channel.send(f"```\n{ROUTER.stats(parts[1].lower())}```")
+
+    if len(parts) != 1 or parts[0].lower() not in STATS:
+        return await channel.send(f"{author.mention} Usage: `{PREFIX}stats <{'|'.join(STATS)}>` or `{PREFIX}stats commands <name>`")
+
+    await channel.send(f"```\n{STATS[parts[0].lower()]()}```")
+
+async def cmd_modules(channel, author, parts):
+    if channel in Bomb.bombs:
+        await Bomb.bombs[channel].cmd_modules(author, parts)
+    else:
+        await modules.cmd_modules(channel, author, parts)
+
+GENERIC_COMMANDS = {
+    "run": Bomb.cmd_run,
+    "bombs": Bomb.cmd_bombs,
+    "shutdown": Bomb.cmd_shutdown,
+    "leaderboard": leaderboard.cmd_leaderboard,
+    "lb": leaderboard.cmd_leaderboard,
+    "rank": leaderboard.cmd_rank,
+    "help": cmd_help,
+    "invite": cmd_invite,
+    "implement": cmd_implement,
+    "allbombs": cmd_allbombs,
+    "stats": cmd_stats,
+    "settings": BombSettings.cmd_settings,
+    "modules": cmd_modules,
+}
+
+ROUTER = Router(GENERIC_COMMANDS, Bomb.COMMANDS, {*modules.VANILLA_MODULES.values(), *modules.MODDED_MODULES.values()})
+
 logging.basicConfig(level=logging.INFO)
 intents = discord.Intents.default()
 intents.message_content = True
 client = discord.Client(intents=intents)
 Bomb.client = client
 
+@FakeDiscord.KeepChannel
+def has_bomb(channel):
+    return channel in Bomb.bombs
+
+# a queued bomb posts to its channel once it starts
+@FakeDiscord.KeepChannel
+def has_queued_bomb(channel):
+    return Bomb.admission.is_queued(channel)
+
 UNICODE_TRANSLATION_TABLE = {ord(x): "'" for x in "`\u2018\u2019\u2032"}
 
+# Read-only commands that only answer with text. They run in their own lane
+# so they never wait behind module renders.
+FAST_COMMANDS = {"help", "status", "edgework", "claims", "unclaimed", "modules", "find", "bombs",
+                 "leaderboard", "lb", "rank", "invite", "implement", "allbombs", "stats"}
+# module commands that answer with text, every other one renders the module
+TEXT_MODULE_COMMANDS = {"claim", "unclaim", "player", "take"}
+# bomb commands that render one of the unclaimed modules, every other one answers with text
+RENDERING_BOMB_COMMANDS = {"claimanyview"}
+
+# `.3 cv; .7 cv; 9 cv` runs several commands in order and answers all of them
+# with one message. Returns (command, parts) for every command in a message.
+def split_commands(content):
+    commands = []
+    for piece in content[len(PREFIX):].translate(UNICODE_TRANSLATION_TABLE).split(";"):
+        piece = piece.strip()
+        if piece.startswith(PREFIX): piece = piece[len(PREFIX):]
+        parts = piece.split()
+        if parts: commands.append((parts[0].lower(), parts[1:]))
+    return commands
+
+# Module commands are tagged with their module, so queued views of the same
+# module can be answered with one render, and cost more the more expensive
+# their module's render is.
+def classify_command(msg, command, parts):
+    if command in FAST_COMMANDS: return "fast", None, "text"
+    resolved = ROUTER.resolve(command, parts, Bomb.bombs.get(msg.channel))
+    if resolved is not None and resolved[0].scope == "bomb" and resolved[0].command in RENDERING_BOMB_COMMANDS:
+        # which module is picked is only known once it runs, so it costs as much as the dearest one it could be
+        unclaimed = [module for module in resolved[1].modules if not module.solved and module.claim is None]
+        if not unclaimed:
+            return "default", None, "text"
+        return "default", None, "animated" if any(module.animated_render for module in unclaimed) else "static"
+    if resolved is None or resolved[0].scope != "module":
+        return "default", None, "text"
+    route, module, rest = resolved
+    view = route.command in ("view", "claimview") and not rest
+    if route.command in TEXT_MODULE_COMMANDS:
+        cost = "text"
+    else:
+        cost = "animated" if module.animated_render else "static"
+    return "default", Tag(module, msg.author, lead=view, follow=view and route.command == "view"), cost
+
+@FakeDiscord.ClassifyMessage
+def classify_message(msg):
+    if not msg.content.startswith(PREFIX): return "fast", None, ()
+    commands = split_commands(msg.content)
+    if not commands: return "fast", None, ("text",)
+    classified = [classify_command(msg, command, parts) for command, parts in commands]
+    if len(classified) == 1:
+        lane, tag, cost = classified[0]
+        return lane, tag, (cost,)
+    # a pipeline is paid for command by command, and never shares a view with other messages
+    lane = "fast" if all(lane == "fast" for lane, _, _ in classified) else "default"
+    return lane, None, tuple(cost for _, _, cost in classified)
+
 @FakeDiscord.OnMessage
 async def on_message(msg):
     print(f"Got message: {msg.content}")
     #if not isinstance(msg.channel, discord.channel.DMChannel) and msg.channel.id not in ALLOWED_CHANNELS: return
     if not msg.content.startswith(PREFIX): return
 
-    parts = msg.content[len(PREFIX):].translate(UNICODE_TRANSLATION_TABLE).strip().split()
-    try:command = parts.pop(0).lower()
-    except:return
+    commands = split_commands(msg.content)
+    if not commands: return
     channel = msg.channel
     author = msg.author
 
+    if len(commands) == 1:
+        await run_command(channel, author, *commands[0])
+    else:
+        await run_pipeline(channel, author, commands)
+
+async def run_command(channel, author, command, parts):
     try:
-        GENERIC_COMMANDS = {
-            "run": Bomb.cmd_run,
-            "bombs": Bomb.cmd_bombs,
-            "shutdown": Bomb.cmd_shutdown,
-            "leaderboard": leaderboard.cmd_leaderboard,
-            "lb": leaderboard.cmd_leaderboard,
-            "rank": leaderboard.cmd_rank,
-            "help": cmd_help,
-            "invite": cmd_invite,
-            "implement": cmd_implement,
-            "allbombs": cmd_allbombs,
-            "settings": BombSettings.cmd_settings
-        }
-
-        if command == "modules":
-            if channel in Bomb.bombs:
-                await Bomb.bombs[channel].cmd_modules(author, parts)
-            else:
-                await modules.cmd_modules(channel, author, parts)
-        elif command in GENERIC_COMMANDS:
-            await GENERIC_COMMANDS[command](channel, author, parts)
+        resolved = ROUTER.resolve(command, parts, Bomb.bombs.get(channel))
+        if resolved is not None:
+            await ROUTER.run(resolved, channel, author)
         elif command.isdigit() or command in Bomb.COMMANDS:
             if channel in Bomb.bombs:
                 await Bomb.bombs[channel].handle_command(command, author, parts)
@@ -108,4 +218,43 @@ async def on_message(msg):
         await channel.send(f"{author.mention} An unidentified ~~flying object~~ error has occured during handling of this command. Please get the log for this bomb to one of our code monkeys, along with a description of what you did to cause this")
         print(f"Exception in {channel}:\n{traceback.format_exc()}")
 
-FakeDiscord.Start()
+# Runs the commands in order, so each one sees what the ones before it did, but
+# holds back their renders until all of them have run and then renders them side
+# by side. Every reply is captured and they all go out as one message.
+async def run_pipeline(channel, author, commands):
+    if len(commands) > MAX_PIPELINE_COMMANDS:
+        await channel.send(f"{author.mention} Only {MAX_PIPELINE_COMMANDS} commands can be combined in one message.")
+        return
+    if any(command.isdigit() and parts and parts[0].lower() == "take" for command, parts in commands):
+        await channel.send(f"{author.mention} `take` waits for a reaction, so it can't be combined with other commands.")
+        return
+
+    replies = [[] for _ in commands]
+    jobs = [[] for _ in commands]
+    for (command, parts), command_replies, command_jobs in zip(commands, replies, jobs):
+        capture_token = DiscordModels.capture.set((channel, command_replies))
+        deferred_token = modules.deferred.set(command_jobs)
+        try:
+            await run_command(channel, author, command, parts)
+        finally:
+            modules.deferred.reset(deferred_token)
+            DiscordModels.capture.reset(capture_token)
+
+    async def run_deferred(command_replies, command_jobs):
+        # each command's replies stay together, in the order the command made them
+        DiscordModels.capture.set((channel, command_replies))
+        for job in command_jobs:
+            try:
+                await job()
+            except Exception:
+                print(f"Exception in deferred work in {channel}:\n{traceback.format_exc()}")
+
+    await asyncio.gather(*(run_deferred(command_replies, command_jobs) for command_replies, command_jobs in zip(replies, jobs)))
+    await channel.send_combined([reply for command_replies in replies for reply in command_replies])
+
+# render workers are spawned processes that import this file again, they must not start the bot
+if __name__ == "__main__":
+    Bomb.renderer.start()
+    asyncio.get_event_loop().create_task(RETENTION.run())
+    asyncio.get_event_loop().create_task(Bomb.prerenderer.run())
+    FakeDiscord.Start()
@@ -16,7 +16,7 @@ def register_module(module):
         pass
 
 # This has to be here to avoid cyclic imports.
-from modules.base import Module, noparts, check_solve_cmd, gif_append, gif_output
+from modules.base import Module, noparts, check_solve_cmd, gif_append, gif_output, deferred, svg2png, layered_svg2png, render_cache, image_encoder, Path
 
 for module_file in glob(path_join(dirname(__file__), "*.py")):
     module_name = basename(module_file)[:-3]
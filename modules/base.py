@@ -2,13 +2,26 @@ from urllib.parse import quote as urlencode
 import io
 import os
 import cairosvg
+import cairosvg.parser
+import cairosvg.surface
+import cairocffi
 import discord
 import asyncio
 import leaderboard
+import BombSettings
 import time
+import copy
+import traceback
+import contextvars
+import threading
+from collections import OrderedDict
 from wand.image import Image
 from config import *
 from modules import register_module
+from Dispatcher import coalesced
+from RenderCache import RenderCache
+from CairoBackend import Drawing, Path
+from ImageEncoder import ImageEncoder
 
 def noparts(func):
     async def wrapper(self, author, parts):
@@ -18,17 +31,112 @@ def noparts(func):
             await func(self, author)
     return wrapper
 
+# Work that has to wait until the module lock is released, such as rendering
+# and uploading views. Set while a command holds the lock, and for the whole
+# of a pipeline of commands, which runs the work of all of them side by side.
+deferred = contextvars.ContextVar("deferred", default=None)
+
+async def defer(job):
+    jobs = deferred.get()
+    if jobs is None:
+        await job()
+    else:
+        jobs.append(job)
+
 def check_solve_cmd(func):
     async def wrapper(self, author, parts):
-        async with self.lock:
-            if self.solved:
-                await self.bomb.channel.send(f"{author.mention} {self} has already been solved.")
-            elif self.claim and self.claim.id != author.id:
-                await self.bomb.channel.send(f"{author.mention} {self} has been claimed by {self.claim}.")
-            else:
-                await func(self, author, parts)
+        token = deferred.set([])
+        try:
+            async with self.lock:
+                if self.solved:
+                    await self.bomb.channel.send(f"{author.mention} {self} has already been solved.")
+                elif self.claim and self.claim.id != author.id:
+                    await self.bomb.channel.send(f"{author.mention} {self} has been claimed by {self.claim}.")
+                else:
+                    await func(self, author, parts)
+        finally:
+            jobs = deferred.get()
+            deferred.reset(token)
+            pipeline = deferred.get()
+            if pipeline is not None:
+                pipeline.extend(jobs)
+                jobs = []
+            # every job runs, later views wait for the earlier ones to be uploaded
+            for job in jobs:
+                try:
+                    await job()
+                except Exception:
+                    print(f"Exception in deferred work of {self}:\n{traceback.format_exc()}")
     return wrapper
 
+# mentions of everyone whose queued `view` is answered by the current command
+def coalesced_mentions():
+    return ''.join(f" {tag.requester.mention}" for tag in coalesced.get())
+
+render_cache = RenderCache(RENDER_CACHE_MEMORY, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", RENDER_CACHE_DIR), RENDER_CACHE_DISK)
+image_encoder = ImageEncoder(IMAGE_FORMATS, IMAGE_GOAL, IMAGE_TRIAL_RENDERS, PNG_COMPRESSION_LEVEL, WEBP_METHOD, IMAGE_UPLOAD_BANDWIDTH, render_cache)
+
+# A render as the render cache takes it: (function, source, options)
+def rasterise(source):
+    render, data, options = source
+    return render_cache.svg2png(render, data, **options)
+
+def svg_source(svg, **options):
+    if isinstance(svg, str): svg = svg.encode()
+    return cairosvg.svg2png, svg, options
+
+# cairosvg.svg2png, answered from the render cache when the same SVG was rendered before
+def svg2png(svg, **options):
+    return rasterise(svg_source(svg, **options))
+
+# Decoded backgrounds by render cache key, most recently used last. Renders
+# run in the thread pool, so the surfaces are only ever painted from.
+background_surfaces = OrderedDict()
+background_lock = threading.Lock()
+
+def background_surface(background, **options):
+    key = RenderCache.key(background.encode(), options)
+    with background_lock:
+        surface = background_surfaces.get(key)
+        if surface is not None:
+            background_surfaces.move_to_end(key)
+            return surface
+    surface = cairocffi.ImageSurface.create_from_png(io.BytesIO(svg2png(background, **options)))
+    with background_lock:
+        background_surfaces[key] = surface
+        while len(background_surfaces) > RENDER_BACKGROUND_SURFACES:
+            background_surfaces.popitem(last=False)
+    return surface
+
+# The overlay rasterised by cairosvg straight onto a surface, without a PNG in between
+def overlay_surface(overlay, unsafe=False, scale=1):
+    tree = cairosvg.parser.Tree(bytestring=overlay.encode(), unsafe=unsafe)
+    return cairosvg.surface.PNGSurface(tree, None, 96, scale=scale).cairo
+
+# The background and overlay SVGs rasterised separately, the overlay painted
+# over a copy of the decoded background. The finished image comes from the
+# render cache if the same overlay was drawn on the same background before.
+def layered_source(background, overlay, **options):
+    def render(layers, **_):
+        under = background_surface(background, **options)
+        surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, under.get_width(), under.get_height())
+        context = cairocffi.Context(surface)
+        context.set_source_surface(under)
+        context.paint()
+        context.set_source_surface(overlay_surface(overlay, **options))
+        context.paint()
+        output = io.BytesIO()
+        surface.write_to_png(output)
+        return output.getvalue()
+    return render, f"{background}\0{overlay}".encode(), {"layered": True, **options}
+
+def layered_svg2png(background, overlay, **options):
+    return rasterise(layered_source(background, overlay, **options))
+
+# A Drawing replayed onto a cairo surface, answered from the render cache like svg2png
+def drawing_source(drawing):
+    return (lambda key, **_: drawing.to_png()), drawing.key(), {"drawn": True}
+
 def gif_append(im, blob, delay):
     im.sequence.append(Image(blob=blob, format='png'))
     with im.sequence[-1] as frame:
@@ -58,6 +166,12 @@ class CommandConsolidator(type):
 class Module(metaclass=CommandConsolidator):
     strike_penalty = 6
     vanilla = False
+    # renders a GIF instead of a single PNG, which costs a lot more
+    animated_render = False
+    # smallest scale the module may be rendered at when the renderer is busy, so its symbols stay legible
+    min_render_scale = 0.5
+    # live state a render snapshot leaves out
+    SNAPSHOT_EXCLUDE = ("_bomb", "lock", "last_img", "last_view", "log_data", "take_pending", "claim")
 
     def __init__(self, bomb, ident):
         self._bomb = bomb
@@ -66,11 +180,11 @@ class Module(metaclass=CommandConsolidator):
         self.claim = None
         self.take_pending = None
         self.last_img = None
+        # finishes when the most recent view has been uploaded
+        self.last_view = None
         self.log_data = []
         self.lock = asyncio.Lock()
         self.FileRoot = os.path.dirname(os.path.realpath(__file__))
-        self.RenderOut = f"{self.FileRoot}/../rendered"
-        if not os.path.isdir(self.RenderOut):os.mkdir(self.RenderOut)
 
     @property
     def bomb(self):
@@ -87,6 +201,18 @@ class Module(metaclass=CommandConsolidator):
     def __str__(self):
         return f'{self.display_name} (#{self.ident})'
 
+    # A copy of the module's state to render from while the module itself keeps
+    # changing. Containers are copied, so the copy can't be changed by later
+    # commands and a render never touches live state.
+    def snapshot(self):
+        snapshot = copy.copy(self)
+        for name, value in vars(self).items():
+            if name in Module.SNAPSHOT_EXCLUDE:
+                setattr(snapshot, name, None)
+            elif isinstance(value, (list, dict, set)):
+                setattr(snapshot, name, copy.deepcopy(value))
+        return snapshot
+
     def log(self, msg):
         entry = self.bomb.get_time_formatted(), msg
         self.log_data.append(entry)
@@ -129,15 +255,18 @@ class Module(metaclass=CommandConsolidator):
         self._solved = True
         if self.claim is None: self.claim = author
         leaderboard.record_solve(author, self.module_score)
-        await self.do_view(f"{author.mention} solved {self}. {self.module_score} {'points have' if self.module_score > 1 else 'point has'} been awarded.")
+        await self.do_view(f"{author.mention} solved {self}. {self.module_score} {'points have' if self.module_score > 1 else 'point has'} been awarded.", priority="critical")
         if self.bomb.get_solved_count() == len(self.bomb.modules):
-            await self.bomb.bomb_end()
+            await defer(self.bomb.bomb_end)
+        elif self.bomb.admission.queue:
+            # the solve takes the module's render cost off the load, a waiting bomb may fit now
+            await defer(self.bomb.start_queued)
 
     async def handle_strike(self, author):
         self.log('strike!')
         self.bomb.strikes += 1
         leaderboard.record_strike(author, self.strike_penalty)
-        await self.do_view(f"{self} got a strike. There {'has' if self.bomb.strikes == 1 else 'have'} been {self.bomb.strikes} {'strike' if self.bomb.strikes == 1 else 'strikes'} so far. -{self.strike_penalty} point{'s' if self.strike_penalty > 1 else ''} from {author.mention}", True)
+        await self.do_view(f"{self} got a strike. There {'has' if self.bomb.strikes == 1 else 'have'} been {self.bomb.strikes} {'strike' if self.bomb.strikes == 1 else 'strikes'} so far. -{self.strike_penalty} point{'s' if self.strike_penalty > 1 else ''} from {author.mention}", True, "critical")
 
     async def handle_unsubmittable(self, author):
         self.log('unsubmittable')
@@ -150,7 +279,25 @@ class Module(metaclass=CommandConsolidator):
         self.log('rendering next stage')
         await self.do_view(f"{author.mention} Good! Next stage:")
 
-    def render(self, strike):
+    # Modules can draw everything that doesn't change while the module is played
+    # in get_background_svg and the rest in get_overlay_svg instead of get_svg.
+    # The background is then only rasterised once per status LED colour.
+    def get_background_svg(self, led):
+        return None
+
+    # Modules can also draw themselves with cairo calls on a Drawing, with
+    # draw(drawing, led). That is used instead of the SVG when DRAW_BACKEND is
+    # "cairo", so no SVG has to be built and parsed for every render.
+    draw = None
+
+    # States the module is likely to be shown in next, as (snapshot, strike)
+    # pairs made from snapshot(). They are rendered into the render cache while
+    # the renderer is idle, so only cheap, likely states are worth listing.
+    def predict_successors(self):
+        return []
+
+    # What render() rasterises, as a source for rasterise()
+    def raster_source(self, strike, scale):
         if self.solved:
             led = '#0f0'
         elif strike:
@@ -158,35 +305,79 @@ class Module(metaclass=CommandConsolidator):
         else:
             led = '#fff'
 
+        scale = max(scale, self.min_render_scale)
+        if DRAW_BACKEND == "cairo" and self.draw is not None:
+            drawing = Drawing(scale=scale)
+            self.draw(drawing, led)
+            return drawing_source(drawing)
+
         # unsafe is needed to include bitmaps, and does not pose a security risk since the user has no control over the SVG
-        index = len(os.listdir(self.RenderOut))+1
-        return cairosvg.svg2png(self.get_svg(led).encode(), unsafe=True), f'render{index}.png'
+        background = self.get_background_svg(led)
+        if background is None:
+            return svg_source(self.get_svg(led), unsafe=True, scale=scale)
+        return layered_source(background, self.get_overlay_svg(), unsafe=True, scale=scale)
+
+    def render(self, strike, scale=1, effort=1):
+        return self.encode(rasterise(self.raster_source(strike, scale)), effort)
+
+    # Identifies the image render() makes without rendering it: the render cache
+    # key of the PNG and the encoder effort. None for modules that render another way.
+    def render_key(self, strike, scale=1, effort=1):
+        if type(self).render is not Module.render:
+            return None
+        _, source, options = self.raster_source(strike, scale)
+        return RenderCache.key(source, options), effort
+
+    # A rendered PNG in the format chosen for uploading images of this module type, and its file name
+    def encode(self, png, effort=1):
+        data, extension = image_encoder.encode(type(self).__name__, png, effort)
+        return data, f'render.{extension}'
 
     @noparts
     async def cmd_view(self, author):
-        await self.do_view(author.mention)
-
-    async def do_view(self, text, strike=False):
-        start_time = time.time()
-        async with self.bomb.client:
-            data, filename = await self.bomb.client.loop.run_in_executor(None, self.render, strike)
-        end_time = time.time()
-        print("Rendering took {:.2}s".format(end_time - start_time))
-        FilePath = f"{self.RenderOut}/{filename}"
-        with open(FilePath, "wb") as file:file.write(data)
-        descr = f"[Manual]({self.get_manual()}). {self.get_help()}" if not self.solved else ''
-        embed = {"title":str(self), "description":descr, "image":f"attachment://{filename}"}
-        #embed = discord.Embed(title=str(self), description=descr)
-        #embed.set_image(url=f"attachment://{filename}")
-
-        #file_ = discord.File(io.BytesIO(data), filename=filename)
-        file_ = {"path":FilePath, "filename":filename}
-        send_task = asyncio.ensure_future(self.bomb.channel.send(text, file=file_, embed=embed))
-        if self.last_img is not None:
-            delete_task = asyncio.ensure_future(self.last_img.delete())
-            self.last_img = (await asyncio.gather(send_task, delete_task))[0]
-        else:
-            self.last_img = (await asyncio.gather(send_task))[0]
+        await self.do_view(author.mention + coalesced_mentions(), priority="view")
+
+    # priority is the render class: "critical" for solves and strikes, "command" for
+    # other command results and "view" for renders nothing has changed for
+    async def do_view(self, text, strike=False, priority="command"):
+        # the state is captured now, the render and upload happen once the lock is released
+        snapshot = self.snapshot()
+        previous, self.last_view = self.last_view, asyncio.get_event_loop().create_future()
+        done = self.last_view
+        await defer(lambda: self.show_view(snapshot, text, strike, previous, done, priority))
+
+    async def show_view(self, snapshot, text, strike, previous, done, priority):
+        try:
+            start_time = time.time()
+            async with self.bomb.client:
+                data, filename, render_time, settings = await self.bomb.renderer.render(snapshot, strike, priority)
+            end_time = time.time()
+            print("Rendering took {:.2}s".format(end_time - start_time))
+            # the render alone, waiting for the renderer isn't part of what the module costs
+            if render_time is not None:
+                self.bomb.admission.costs.record_render(type(self), render_time)
+            asyncio.ensure_future(self.bomb.prerenderer.shown(self, snapshot, strike, settings))
+            descr = f"[Manual]({snapshot.get_manual()}). {snapshot.get_help()}" if not snapshot.solved else ''
+            embed = {"title":str(snapshot), "description":descr, "image":f"attachment://{filename}"}
+            #embed = discord.Embed(title=str(self), description=descr)
+            #embed.set_image(url=f"attachment://{filename}")
+
+            #file_ = discord.File(io.BytesIO(data), filename=filename)
+            file_ = {"data":data, "filename":filename}
+            # renders may finish out of order, uploads don't
+            if previous is not None:
+                await previous
+            if self.bomb.settings.view is BombSettings.ViewMode.Edit and self.last_img is not None:
+                if await self.last_img.edit(text, file=file_, embed=embed):
+                    return
+            send_task = asyncio.ensure_future(self.bomb.channel.send(text, file=file_, embed=embed))
+            if self.last_img is not None:
+                delete_task = asyncio.ensure_future(self.last_img.delete())
+                self.last_img = (await asyncio.gather(send_task, delete_task))[0]
+            else:
+                self.last_img = (await asyncio.gather(send_task))[0]
+        finally:
+            done.set_result(None)
 
     @noparts
     async def cmd_claim(self, author):
@@ -211,7 +402,9 @@ class Module(metaclass=CommandConsolidator):
     @noparts
     async def cmd_claimview(self, author):
         if await self.do_claim(author):
-            await self.do_view(f"{author.mention} {self} is yours now.")
+            await self.do_view(f"{author.mention} {self} is yours now.{coalesced_mentions()}", priority="view")
+        elif coalesced.get():
+            await self.do_view(coalesced_mentions().lstrip(), priority="view")
 
     @noparts
     async def cmd_unclaim(self, author):
@@ -240,8 +433,9 @@ class Module(metaclass=CommandConsolidator):
             self.take_pending = author
             msg = await self.bomb.channel.send(f"{self.claim.mention} {author} wants to take {self}. React with {TAKE_REACT} within {TAKE_TIMEOUT} seconds to confirm you are still working on the module")
             await msg.add_reaction(TAKE_REACT)
+            message_id = await msg.get_id()
             try:
-                await self.bomb.client.wait_for('reaction_add', timeout=TAKE_TIMEOUT, check=lambda reaction, user: reaction.emoji == TAKE_REACT and user == self.claim and reaction.message.id == msg.id)
+                await self.bomb.client.wait_for('reaction_add', timeout=TAKE_TIMEOUT, check=lambda reaction, user: reaction.emoji == TAKE_REACT and user == self.claim and reaction.message.id == message_id)
             except asyncio.TimeoutError:
                 await self.bomb.channel.send(f"{author.mention} {self} is now yours.")
                 self.claim = author
@@ -63,6 +63,17 @@ class Button(modules.Module):
         svg += '</svg>'
         return svg
 
+    # holding the button, with each strip colour
+    def predict_successors(self):
+        if self.strip_color is not None:
+            return []
+        predictions = []
+        for color in Button.Color:
+            prediction = self.snapshot()
+            prediction.strip_color = color
+            predictions.append((prediction, False))
+        return predictions
+
     @modules.check_solve_cmd
     @modules.noparts
     async def cmd_tap(self, author):
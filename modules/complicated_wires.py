@@ -148,7 +148,8 @@ class ComplicatedWires(modules.Module):
         svg = '<svg viewBox="0 0 348 348" fill="#fff" stroke="none" stroke-linecap="butt" stroke-linejoin="round" stroke-miterlimit="10">'
         if needed_gradients:
             svg += '<defs>'
-            for gradient in needed_gradients:
+            # sorted, so the SVG (and its render cache key) doesn't depend on set order
+            for gradient in sorted(needed_gradients, key=lambda gradient: (gradient[0].name, gradient[1].name)):
                 svg += f'<linearGradient id="{gradient[0].name}-{gradient[1].name}" x1="0%" x2="5%" y1="0%" y2="100%">'
                 for percent in range(0, 100, 20):
                     svg += (f'<stop offset="{percent}%" stop-color="{gradient[0].value}"/>'
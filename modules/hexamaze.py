@@ -312,11 +312,13 @@ class Hexamaze(modules.Module):
     BUTTON_PATH = generate_buttons(EDGE, XSCALE, YSCALE)
     del generate_buttons
 
-    def get_svg(self, led):
-        def to_image_coords(cell):
-            q, r = cell
-            return 174 + q * Hexamaze.XSCALE, 174 + (q + 2 * r) * Hexamaze.YSCALE
+    @staticmethod
+    def to_image_coords(cell):
+        q, r = cell
+        return 174 + q * Hexamaze.XSCALE, 174 + (q + 2 * r) * Hexamaze.YSCALE
 
+    # the markings are fixed for the whole game, so they are part of the background
+    def get_background_svg(self, led):
         svg = ('<svg viewBox="0 0 348 348" fill="none" stroke-width="2" stroke-linejoin="round" stroke-linecap="butt" stroke-miterlimit="10" xmlns:xlink="http://www.w3.org/1999/xlink">'
             '<path stroke="#000" fill="#fff" d="M5 5h338v338h-338z"/>'
             f'<circle fill="{led}" stroke="#000" cx="298" cy="40.5" r="15"/>'
@@ -329,8 +331,7 @@ class Hexamaze(modules.Module):
             '<g clip-path="url(#clip)">')
 
         for cell in Hexamaze.grid_iterate():
-            x, y = to_image_coords(cell)
-            pawn = self.position == cell
+            x, y = Hexamaze.to_image_coords(cell)
             big_maze_coords = self.small2big(cell)
             MARKING_SCALE = 0.7
             if big_maze_coords in Hexamaze.MARKINGS:
@@ -365,11 +366,25 @@ class Hexamaze(modules.Module):
                         f'v-{Hexamaze.EDGE * MARKING_SCALE * 3 / 2}z"/>')
                 else:
                     assert False
-            svg += f'<circle cx="{x}" cy="{y}" r="{6 if pawn else 4}" fill="{Hexamaze.PAWN_COLORS[self.pawn_color] if pawn else "#ccc"}"/>'
+            svg += f'<circle cx="{x}" cy="{y}" r="4" fill="#ccc"/>'
+
+        svg += ('</g>'
+            '</svg>')
+        return svg
+
+    def get_overlay_svg(self):
+        x, y = Hexamaze.to_image_coords(self.position)
+        # the pawn covers the grey dot of its cell
+        svg = ('<svg viewBox="0 0 348 348" fill="none" stroke-width="2" stroke-linejoin="round" stroke-linecap="butt" stroke-miterlimit="10">'
+            '<clipPath id="clip">'
+            f'<path d="{Hexamaze.BORDER_PATH}"/>'
+            '</clipPath>'
+            '<g clip-path="url(#clip)">'
+            f'<circle cx="{x}" cy="{y}" r="6" fill="{Hexamaze.PAWN_COLORS[self.pawn_color]}"/>')
 
         wall_path = ""
-        for cell, direction in self.visible_walls:
-            x, y = to_image_coords(cell)
+        for cell, direction in sorted(self.visible_walls):
+            x, y = Hexamaze.to_image_coords(cell)
             if direction == 0:
                 wall_path += f'M{x - Hexamaze.EDGE} {y}l{Hexamaze.EDGE / 2}-{Hexamaze.YSCALE}'
             elif direction == 1:
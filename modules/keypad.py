@@ -9,6 +9,8 @@ class Keypad(modules.Module):
     help_text = "`{cmd} press 1 3 2 4` or `{cmd} press 1324` or `{cmd} press tl bl tr br`. Partial solutions allowed."
     module_score = 1
     vanilla = True
+    # the symbols lose their details below this
+    min_render_scale = 0.75
 
     BUTTONS = ['tl', 'tr', 'bl', 'br']
 
@@ -110,6 +110,8 @@ class Maze(modules.Module):
             self.goal = random.randint(0, 5), random.randint(0, 5)
             if abs(self.position[0] - self.goal[0]) > 1 or abs(self.position[1] - self.goal[1]) > 1:
                 break
+        # chosen once, so every render of the same state is the same image
+        self.goal_rotation = random.random() * math.pi * 2
         self.log(f"Goal: {self.goal}. Maze chosen:\n{maze}")
 
     def get_svg(self, led):
@@ -126,7 +128,7 @@ class Maze(modules.Module):
         for marker in self.markers:
             svg += f'<circle stroke="#0f0" cx="{86 + marker[0] * 35}.5" cy="{86 + marker[1] * 35}.5" r="15"/>'
 
-        goal_rotation = random.random() * math.pi * 2
+        goal_rotation = self.goal_rotation
         goal_x = 86.5 + self.goal[0] * 35
         goal_y = 86.5 + self.goal[1] * 35
         goal_ax = goal_x + math.cos(goal_rotation) * 12
@@ -141,6 +143,20 @@ class Maze(modules.Module):
 
         return svg
 
+    # a move in each direction that doesn't run into a wall
+    def predict_successors(self):
+        predictions = []
+        cell = self.grid[self.position[1]][self.position[0]]
+        for move, (dx, dy) in ((Maze.Direction.up, (0, -1)), (Maze.Direction.down, (0, 1)), (Maze.Direction.left, (-1, 0)), (Maze.Direction.right, (1, 0))):
+            newx, newy = self.position[0] + dx, self.position[1] + dy
+            if newx not in range(6) or newy not in range(6) or cell & move:
+                continue
+            prediction = self.snapshot()
+            prediction.position = newx, newy
+            prediction._solved = prediction.position == self.goal
+            predictions.append((prediction, False))
+        return predictions
+
     @modules.check_solve_cmd
     async def cmd_move(self, author, parts):
         moves = []
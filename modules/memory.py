@@ -25,14 +25,19 @@ class Memory(modules.Module):
         random.shuffle(self.buttons)
         self.log(f"Randomized on stage {self.stage}. Display is {self.display}. Buttons: {' '.join(map(str, self.buttons))}")
 
-    def get_svg(self, led):
-        svg = (
+    def get_background_svg(self, led):
+        return (
             f'<svg viewBox="0 0 348 348" fill="#fff" stroke="none" stroke-linejoin="round" stroke-linecap="butt" stroke-miterlimit="10">'
             f'<path stroke="#000" stroke-width="2" d="M5 5h338v338h-338z"/>'
             f'<circle fill="{led}" stroke="#000" cx="298" cy="40.5" r="15" stroke-width="2"/>'
             f'<path fill="#000" stroke="#000" d="M30 70h225v129h-225z"/>'
             f'<path stroke="#000" d="M30 210h48v70h-48zm59 0h48v70h-48zm59 0h48v70h-48zm59 0h48v70h-48z"/>'
             f'<path fill="#000" stroke="#000" d="M276 70h52v210h-52z"/>'
+            f'</svg>')
+
+    def get_overlay_svg(self):
+        svg = (
+            f'<svg viewBox="0 0 348 348" fill="#fff" stroke="none" stroke-linejoin="round" stroke-linecap="butt" stroke-miterlimit="10">'
             f'<text x="142.5" y="165" text-anchor="middle" style="font-size:64pt;font-family:sans-serif;">{self.display}</text>')
 
         for stage in range(5):
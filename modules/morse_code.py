@@ -1,5 +1,4 @@
 import random
-import cairosvg
 import modules
 from functools import lru_cache
 from wand.image import Image
@@ -42,6 +41,9 @@ class MorseCode(modules.Module):
     help_text = "`{cmd} tx 3.545`, `{cmd} tx 545`, `{cmd} tx 3.545 MHz`, or `{cmd} transmit ...` to transmit on 3.545 MHz."
     module_score = 3
     vanilla = True
+    animated_render = True
+    # the frequency and the TX/RX labels have to stay readable
+    min_render_scale = 0.75
 
     WORDS = {
         "shell":  505,
@@ -71,27 +73,36 @@ class MorseCode(modules.Module):
         self.last_frequency = 505
         self.log(f"The word is {self.word}, with a frequency of 3.{self.frequency} MHz")
 
-    def get_image(self, rx_led, solve_led):
-        svg = (
+    def get_background_svg(self, led):
+        return (
             f'<svg viewBox="0 0 348 348" fill="#fff" stroke-linecap="butt" stroke-linejoin="round" stroke-miterlimit="10">'
             f'<path stroke="#000" stroke-width="2" d="M5 5h338v338h-338zM48 139h252v30h-252zm41 0v14m50-14v14m50-14v14m50-14v14m50-14v14m-225 16v-10m50 10v-10m50 10v-10m50 10v-10m50 10v-10M155 50h120M5 5l30 45M129 290h90v35h-90zM24 120h300v160h-300z"/>'
-            f'<circle fill="{solve_led}" stroke="#000" cx="298" cy="40.5" r="15" stroke-width="2"/>'
+            f'<circle fill="{led}" stroke="#000" cx="298" cy="40.5" r="15" stroke-width="2"/>'
             f'<path fill="#000" d="M64 187h220v72h-220z"/>'
+            f'<text x="174" y="318" text-anchor="middle" fill="#000" style="font-size:20pt;font-family:sans-serif;">TX</text>'
+            f'</svg>')
+
+    # the light's holders are drawn over the light, so they are part of the overlay
+    def get_overlay_svg(self, rx_led=False):
+        return (
+            f'<svg viewBox="0 0 348 348" fill="#fff" stroke-linecap="butt" stroke-linejoin="round" stroke-miterlimit="10">'
             f'<ellipse cx="95" cy="50" rx="60" ry="15" fill="{"#ff0" if rx_led else "#fff"}" stroke="#000" stroke-width="2"/>'
             f'<path fill="#000" stroke="#000" stroke-width="2" d="M46 23h12v54h-12zM132 23h12v54h-12zM55 197l-22 26 22 26zM293 197l22 26-22 26zM{(self.last_frequency - 500) * 236 / 100 + 52} 134h9v40h-9z"/>'
-            f'<text x="174" y="318" text-anchor="middle" fill="#000" style="font-size:20pt;font-family:sans-serif;">TX</text>'
             f'<text x="174" y="237" text-anchor="middle" style="font-size:28pt;font-family:sans-serif;">3.{self.last_frequency} MHz</text>'
             f'</svg>')
-        return cairosvg.svg2png(svg.encode())
 
-    def render(self, strike):
+    def get_image(self, rx_led, solve_led, scale=1):
+        return modules.layered_svg2png(self.get_background_svg(solve_led), self.get_overlay_svg(rx_led), scale=scale)
+
+    def render(self, strike, scale=1, effort=1):
+        scale = max(scale, self.min_render_scale)
         if self.solved:
-            return self.get_image(False, '#0f0'), 'render.png'
+            return self.encode(self.get_image(False, '#0f0', scale), effort)
 
         led = '#f00' if strike else '#fff'
 
-        on = self.get_image(True, led)
-        off = self.get_image(False, led)
+        on = self.get_image(True, led, scale)
+        off = self.get_image(False, led, scale)
 
         with Image() as im:
             def add(frame, units):
@@ -2,7 +2,6 @@ from string import ascii_lowercase as abc
 from wand.image import Image
 import modules
 import random
-import cairosvg
 
 class Password(modules.Module):
     identifiers = ['password']
@@ -11,6 +10,9 @@ class Password(modules.Module):
     help_text = "`{cmd} cycle 3` - cycle the third column. `{cmd} cycle 1 3 5`, `{cmd} cycle 135` - cycle multiple columns. `{cmd} cycle` - cycle all columns. `{cmd} submit water` - try to submit a word. "
     module_score = 2
     vanilla = True
+    animated_render = True
+    # the SUBMIT label has to stay readable
+    min_render_scale = 0.75
 
     WORDS = [
         "about", "after", "again", "below", "could",
@@ -60,7 +62,7 @@ class Password(modules.Module):
                 return False
         return True
 
-    def get_image(self, led):
+    def get_image(self, led, positions, scale=1):
         svg = ( '<svg viewBox="0 0 348 348" fill="none" stroke="none" stroke-width="2" stroke-linecap="butt" stroke-linejoin="round" stroke-miterlimit="10">'
             '<path stroke="#000" fill="#fff" d="M5 5h338v338h-338z"/>'
             f'<circle fill="{led}" stroke="#000" cx="298" cy="40.5" r="15"/>'
@@ -69,30 +71,33 @@ class Password(modules.Module):
             '<path fill="#000" stroke="#000" d="M44 99h260v150h-260zM74 80l3 5h-6zm50 0l3 5h-6zm50 0l3 5h-6zm50 0l3 5h-6zm50 0l3 5h-6zM74 268l3-5h-6zm50 0l3-5h-6zm50 0l3-5h-6zm50 0l3-5h-6zm50 0l3-5h-6z"/>'
             '<path fill="#fff" d="M50 105h48v138h-48zm50 0h48v138h-48zm50 0h48v138h-48zm50 0h48v138h-48zm50 0h48v138h-48z"/>')
 
-        for pos, letters, index in zip(range(5), self.spinners, self.positions):
+        for pos, letters, index in zip(range(5), self.spinners, positions):
             x = 74 + pos * 50
             svg += (f'<circle cx="{x}" cy="83" r="9" stroke="#000"/>'
                 f'<circle cx="{x}" cy="265" r="9" stroke="#000"/>'
                 f'<text fill="#000" text-anchor="middle" x="{x}" y="188" style="font-family:sans-serif;font-size:28pt;">{letters[index].upper()}</text>')
         svg += '</svg>'
-        return cairosvg.svg2png(svg.encode())
+        return modules.svg2png(svg, scale=scale)
 
-    def render(self, strike):
+    def render(self, strike, scale=1, effort=1):
+        scale = max(scale, self.min_render_scale)
         if self.solved:
-            return self.get_image('#0f0'), 'render.png'
+            return self.encode(self.get_image('#0f0', self.positions, scale), effort)
 
         led = '#f00' if strike else '#fff'
 
         if self.cycle is None:
-            return self.get_image('#f00' if strike else '#fff'), 'render.png'
+            return self.encode(self.get_image('#f00' if strike else '#fff', self.positions, scale), effort)
 
+        # the animation turns each column all the way around, so the module ends up as it started
+        positions = list(self.positions)
         with Image() as im:
             for column in self.cycle:
                 first = True
                 for _ in range(6):
-                    modules.gif_append(im, self.get_image(led), 200 if first else 100)
+                    modules.gif_append(im, self.get_image(led, positions, scale), 200 if first else 100)
                     first = False
-                    self.positions[column] = (self.positions[column] + 1) % 6
+                    positions[column] = (positions[column] + 1) % 6
 
             return modules.gif_output(im)
 
@@ -1,5 +1,4 @@
 import random
-import cairosvg
 import enum
 import modules
 from functools import lru_cache
@@ -12,6 +11,7 @@ class SimonSays(modules.Module):
     help_text = "`{cmd} press red green blue yellow`, `{cmd} press rgby`. You must include the input from any previous stages."
     module_score = 3
     vanilla = True
+    animated_render = True
 
     class Color(enum.Enum):
         red = enum.auto()
@@ -40,7 +40,7 @@ class SimonSays(modules.Module):
 
     @staticmethod
     @lru_cache(maxsize=16)
-    def get_image(color, led):
+    def get_image(color, led, scale=1):
         svg = (
             f'<svg viewBox="0 0 348 348" fill="#fff" stroke-linecap="butt" stroke-linejoin="round" stroke-miterlimit="10">'
             f'<path stroke="#000" stroke-width="2" d="M5 5h338v338h-338z"/>'
@@ -50,17 +50,18 @@ class SimonSays(modules.Module):
             '<path fill="{:s}" stroke="#000" stroke-width="2" d="M120 122l52-52 52 52-52 52z"/>'.format('#00f' if color == SimonSays.Color.blue else '#003') +
             '<path fill="{:s}" stroke="#000" stroke-width="2" d="M172 174l52-52 52 52-52 52z"/>'.format('#ff0' if color == SimonSays.Color.yellow else '#330') +
             '</svg>')
-        return cairosvg.svg2png(svg.encode())
+        return modules.svg2png(svg, scale=scale)
 
-    def render(self, strike):
+    def render(self, strike, scale=1, effort=1):
+        scale = max(scale, self.min_render_scale)
         if self.solved:
-            return SimonSays.get_image(None, '#0f0'), 'render.png'
+            return self.encode(SimonSays.get_image(None, '#0f0', scale), effort)
 
         led = '#f00' if strike else '#fff'
 
         with Image() as im:
             def add(color, delay):
-                modules.gif_append(im, SimonSays.get_image(color, led), delay)
+                modules.gif_append(im, SimonSays.get_image(color, led, scale), delay)
 
             add(None, 200)
 
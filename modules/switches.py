@@ -75,6 +75,19 @@ class Switches(modules.Module):
         output += '</svg>'
         return output
 
+    # every switch that can be flipped
+    def predict_successors(self):
+        predictions = []
+        for switch in range(5):
+            new_position = self.position ^ self.bitmask_for_switch(switch)
+            if new_position in self.invalid_positions:
+                continue
+            prediction = self.snapshot()
+            prediction.position = new_position
+            prediction._solved = new_position == self.solution
+            predictions.append((prediction, False))
+        return predictions
+
     @modules.check_solve_cmd
     async def cmd_flip(self, author, parts):
         if not parts:
@@ -4,6 +4,9 @@ import modules
 # Abstract superclass containing code shared
 # between Who's on First and Third Base
 class WoFCommon(modules.Module):
+    # the button labels have to stay readable
+    min_render_scale = 0.75
+
     # Called on each button while parsing.
     def canonical_button_name(self,v):
         raise NotImplementedError
@@ -38,6 +41,15 @@ class WoFCommon(modules.Module):
         self.buttons = random.sample(random.choice(self.BUTTON_GROUPS), 6)
         self.log(f"State randomized. Stage {self.stage}. Display: {self.display}. Buttons: {' '.join(self.buttons)}")
 
+    # every other press rerolls the display and buttons, so only the solve on the last stage is known in advance
+    def predict_successors(self):
+        if self.stage != 2:
+            return []
+        solved = self.snapshot()
+        solved.stage += 1
+        solved._solved = True
+        return [(solved, False)]
+
     @modules.check_solve_cmd
     async def cmd_push(self, author, parts):
         if not parts:
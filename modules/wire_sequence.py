@@ -50,6 +50,13 @@ class WireSequence(modules.Module):
         (2, 2): "m 186.5774,243.29985 48.36425,0.0807 0.01,-6 -48.37365,-0.0809 z m -13.41046,-6.02241 -47.00826,-0.0785 -0.01,6 47.01838,0.18422 z",
     }
 
+    FRAME = modules.Path("M5 5h338v338h-338z")
+    PANEL = modules.Path("M74 74h200v200h-200zM129 19h90v40h-90zM129 288h90v40h-90z")
+    ARROWS = modules.Path("M158 39l16-10 16 10h-8v10h-16v-10zM158 308l16 10 16-10h-8v-10h-16v10z")
+    STAGES = modules.Path("M283 74h52v254h-52z")
+    PARSED_UNCUT = {position: modules.Path(d) for position, d in PATHS_UNCUT.items()}
+    PARSED_CUT = {position: modules.Path(d) for position, d in PATHS_CUT.items()}
+
     def __init__(self, bomb, ident):
         super().__init__(bomb, ident)
         self.current_page = 0
@@ -84,14 +91,18 @@ class WireSequence(modules.Module):
             should_cut = "cut" if self.should_cut[index] else "don't count"
             self.log(f"Wire {index + 1} to {'ABC'[to]} is the {counts[color]}. {color.name} wire - {should_cut}")
 
-    def get_svg(self, led):
-        svg = (
+    def get_background_svg(self, led):
+        return (
             f'<svg viewBox="0 0 348 348" fill="#fff" stroke-width="2" stroke-linejoin="round" stroke-linecap="butt" stroke-miterlimit="10" xmlns="http://www.w3.org/2000/svg">'
             f'<path stroke="#000" d="M5 5h338v338h-338z"/>'
             f'<path stroke="#000" d="M74 74h200v200h-200zM129 19h90v40h-90zM129 288h90v40h-90z"/>'
             f'<circle fill="{led}" stroke="#000" cx="298" cy="40.5" r="15"/>'
             f'<path fill="#000" d="M158 39l16-10 16 10h-8v10h-16v-10zM158 308l16 10 16-10h-8v-10h-16v10z"/>'
-            f'<path fill="#000" stroke="#000" d="M283 74h52v254h-52z"/>')
+            f'<path fill="#000" stroke="#000" d="M283 74h52v254h-52z"/>'
+            f'</svg>')
+
+    def get_overlay_svg(self):
+        svg = f'<svg viewBox="0 0 348 348" fill="#fff" stroke-width="2" stroke-linejoin="round" stroke-linecap="butt" stroke-miterlimit="10" xmlns="http://www.w3.org/2000/svg">'
 
         for i in range(4):
             color = "#0f0" if self.solved_pages > i else "#fff"
@@ -116,6 +127,47 @@ class WireSequence(modules.Module):
         svg += f'</svg>'
         return svg
 
+    def draw(self, drawing, led):
+        drawing.path(WireSequence.FRAME, fill="#fff", stroke="#000")
+        drawing.path(WireSequence.PANEL, fill="#fff", stroke="#000")
+        drawing.circle(298, 40.5, 15, fill=led, stroke="#000")
+        drawing.path(WireSequence.ARROWS, fill="#000")
+        drawing.path(WireSequence.STAGES, fill="#000", stroke="#000")
+        for i in range(4):
+            color = "#0f0" if self.solved_pages > i else "#fff"
+            drawing.path(f"M294 {273 - 55 * i}h30v21h-30z", fill=color, stroke=color)
+
+        if self.solved:
+            drawing.path("M74 174h200", stroke="#000")
+            return
+        for i in range(3):
+            wire_index = self.current_page * 3 + i
+            drawing.text(104, 114 + 70 * i, str(wire_index + 1), 24)
+            drawing.text(249, 114 + 70 * i, "ABC"[i], 24)
+            wire = self.wires[wire_index]
+            if wire is not None:
+                color, to = wire
+                path = WireSequence.PARSED_CUT[i, to] if self.cut[wire_index] else WireSequence.PARSED_UNCUT[i, to]
+                drawing.path(path, fill=color.value, stroke="#000")
+
+    # cutting each wire on the panel that has to be cut, and the next panel once they are
+    def predict_successors(self):
+        predictions = []
+        page = range(3 * self.current_page, 3 * self.current_page + 3)
+        for wire in page:
+            if self.should_cut[wire] and not self.cut[wire]:
+                prediction = self.snapshot()
+                prediction.cut[wire] = True
+                predictions.append((prediction, False))
+        prediction = self.snapshot()
+        for wire in page:
+            prediction.cut[wire] = prediction.cut[wire] or prediction.should_cut[wire]
+        prediction.current_page += 1
+        prediction.solved_pages = max(prediction.solved_pages, prediction.current_page)
+        prediction._solved = prediction.current_page >= 4
+        predictions.append((prediction, False))
+        return predictions
+
     @modules.check_solve_cmd
     @modules.noparts
     async def cmd_up(self, author):
@@ -36,6 +36,10 @@ class Wires(modules.Module):
         "M135.9082,249.06641 c -6.63407,0 -12.00903,3.43897 -16.78711,7.08007 -4.77807,3.64111 -9.16867,7.58585 -13.63281,9.65821 -6.384119,2.96364 -15.125811,4.48387 -23.103514,3.75 -7.977704,-0.73388 -15.011192,-3.66727 -18.826172,-8.90821 l -4.84961,3.53125 c 5.213707,7.16248 14.032238,10.51493 23.126954,11.35157 9.094715,0.83663 18.646612,-0.7871 26.177732,-4.28321 5.65903,-2.62704 10.26447,-6.91246 14.74414,-10.32617 4.47968,-3.41371 8.62368,-5.85351 13.15039,-5.85351 z m 27.89258,4.90429 -2.17383,5.5918 c 0.64279,0.24994 1.23113,0.84192 1.88086,2.14844 0.64974,1.30651 1.21441,3.16606 1.81641,5.125 0.602,1.95894 1.22072,4.02182 2.39844,5.91992 1.17771,1.8981 3.32051,3.72029 6.04296,3.93359 33.00536,2.58613 66.99569,0.93388 99.24805,-7.13672 l -1.45508,-5.82031 c -31.47542,7.87618 -64.83765,9.52009 -97.32421,6.97461 -0.6586,-0.0516 -0.82751,-0.17109 -1.41211,-1.11328 -0.58461,-0.94219 -1.17963,-2.61903 -1.76368,-4.51953 -0.58404,-1.9005 -1.17719,-4.01931 -2.17968,-6.03516 -1.0025,-2.01585 -2.56005,-4.08925 -5.07813,-5.06836 z",
     ]
 
+    FRAME = modules.Path("M5 5h338v338h-338zM47 62h30v226h-30zM258 107h30v178h-30z")
+    PARSED_UNCUT = [modules.Path(d) for d in PATHS_UNCUT]
+    PARSED_CUT = [modules.Path(d) for d in PATHS_CUT]
+
     def __init__(self, bomb, ident):
         super().__init__(bomb, ident)
         wire_count = random.randint(3, 8)
@@ -58,6 +62,13 @@ class Wires(modules.Module):
         svg += '</svg>'
         return svg
 
+    def draw(self, drawing, led):
+        drawing.path(Wires.FRAME, fill="#fff", stroke="#000")
+        drawing.circle(298, 40.5, 15, fill=led, stroke="#000")
+        for pos, color, cut in zip(self.positions, self.colors, self.cut):
+            paths = Wires.PARSED_CUT if cut else Wires.PARSED_UNCUT
+            drawing.path(paths[pos], fill=color.value, stroke="#000")
+
     @modules.check_solve_cmd
     async def cmd_cut(self, author, parts):
         if len(parts) != 1 or not parts[0].isdigit():